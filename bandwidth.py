@@ -0,0 +1,136 @@
+import json
+import os
+import threading
+import time
+
+# Runtime-adjustable limits, re-read whenever the file changes. Example:
+# {
+#   "global": 2097152,                      bytes/s for all transfers, 0 = unlimited
+#   "hosts": {"media.example.com": 524288}, per-host caps
+#   "default_host": 0,                      cap for hosts not listed
+#   "schedule": [{"start": "09:00", "end": "18:00", "global": 524288}]
+# }
+# Schedule windows use local time, may cross midnight, and override "global" while active.
+BANDWIDTH_FILE = "bandwidth.json"
+REFRESH_INTERVAL = 2.0  # Seconds between checks of the file and the schedule
+BURST_SECONDS = 0.1  # Bucket capacity in seconds of traffic; small keeps throughput smooth
+
+class TokenBucket:
+    """A byte-rate limiter shared by every thread that draws from it.
+
+    Transfers take tokens as they read chunks, so idle or finished transfers
+    leave the whole rate to the active ones.
+    """
+
+    def __init__(self, rate=0):
+        self.cond = threading.Condition()
+        self.rate = 0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        """Change the rate in bytes/s (0 = unlimited); waiting transfers pick it up immediately."""
+        with self.cond:
+            self._refill()
+            self.rate = rate
+            self.capacity = rate * BURST_SECONDS
+            self.tokens = min(self.tokens, self.capacity)
+            self.cond.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.capacity)
+        self.updated = now
+
+    def consume(self, amount):
+        """Block until `amount` bytes may pass.
+
+        The bucket may go into debt by one chunk, which keeps the average
+        rate exact without making chunks larger than the burst wait forever.
+        """
+        with self.cond:
+            while self.rate:
+                self._refill()
+                if self.tokens >= 0:
+                    self.tokens -= amount
+                    return
+                # Wake up at least twice a second so rate changes apply quickly
+                self.cond.wait(min(-self.tokens / self.rate, 0.5))
+
+def parse_clock(value):
+    """Convert 'HH:MM' to minutes after midnight."""
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+def scheduled_rate(schedule, default, now=None):
+    """Return the rate of the schedule window covering `now`, or `default` outside all windows."""
+    now = time.localtime() if now is None else now
+    minute = now.tm_hour * 60 + now.tm_min
+    for window in schedule:
+        start, end = parse_clock(window['start']), parse_clock(window['end'])
+        inside = start <= minute < end if start <= end else minute >= start or minute < end
+        if inside:
+            return window['global']
+    return default
+
+class BandwidthLimiter:
+    """Global and per-host token buckets driven by BANDWIDTH_FILE and its time-window schedule."""
+
+    def __init__(self, config_file=BANDWIDTH_FILE):
+        self.config_file = config_file
+        self.lock = threading.Lock()
+        self.global_bucket = TokenBucket()
+        self.host_buckets = {}
+        self.config = {}
+        self.mtime = None
+        self.checked = 0.0
+
+    def configure(self, config):
+        """Apply a limits dict in the BANDWIDTH_FILE format."""
+        with self.lock:
+            self.config = config
+            for host, bucket in self.host_buckets.items():
+                bucket.set_rate(self.host_rate(host))
+        self.global_bucket.set_rate(scheduled_rate(config.get('schedule', []), config.get('global', 0)))
+
+    def host_rate(self, host):
+        return self.config.get('hosts', {}).get(host, self.config.get('default_host', 0))
+
+    def refresh(self):
+        """Reload the limits file if it changed and re-evaluate the schedule."""
+        now = time.monotonic()
+        if now - self.checked < REFRESH_INTERVAL:
+            return
+        self.checked = now
+        try:
+            mtime = os.path.getmtime(self.config_file)
+        except OSError:
+            mtime = None
+        if mtime != self.mtime:
+            self.mtime = mtime
+            config = {}
+            if mtime is not None:
+                try:
+                    with open(self.config_file, "r") as f:
+                        config = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"Ignoring unreadable bandwidth file {self.config_file}: {e}")
+                    return
+            self.configure(config)
+        elif self.config.get('schedule'):
+            self.global_bucket.set_rate(scheduled_rate(self.config['schedule'], self.config.get('global', 0)))
+
+    def throttle(self, host, amount):
+        """Wait until `amount` bytes from `host` fit in both its host budget and the global one."""
+        self.refresh()
+        bucket = self.host_buckets.get(host)
+        if bucket is None:
+            with self.lock:
+                bucket = self.host_buckets.setdefault(host, TokenBucket(self.host_rate(host)))
+        bucket.consume(amount)
+        self.global_bucket.consume(amount)
+
+# Shared by every download thread in the process
+limiter = BandwidthLimiter()
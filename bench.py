@@ -0,0 +1,424 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import as_completed
+
+from fakeserver import start_server
+
+BENCH_OUTPUT = "bench_output.txt"
+
+# Startup benchmark: a poll with nothing new to download, interpreter start to exit
+STARTUP_RUNS = 5
+STARTUP_BUDGET_MS = 400
+LAZY_MODULES = ('bs4', 'tkinter', 'tqdm', 'multiprocessing')  # Must not load on the no-work path
+
+# Feed transfer benchmark: bytes on the wire and fetch+parse latency with and without compression
+FEED_ITEMS = 20000
+FEED_RUNS = 5
+
+# Plan memory benchmark: peak RSS of planning and running a large plan with the network stubbed out
+PLAN_MEMORY_ITEMS = (10000, 100000)
+PLAN_MEMORY_MODES = ('legacy', 'compact')
+
+# Queue crash benchmark: N worker processes drain a shared queue, one is killed while it holds a lease
+QUEUE_WORKERS = 3
+QUEUE_ITEMS = 30
+QUEUE_LEASE_TIMEOUT = 3  # Seconds; short so the killed worker's items come back quickly
+QUEUE_SERVER = {'media_size': 256 * 1024, 'bandwidth': 400 * 1024}  # Slow enough that leases are held a while
+QUEUE_DEADLINE = 300  # Seconds to wait for the surviving workers
+
+# Each scenario names the engine to run and the fake server configuration
+SCENARIOS = {
+    'i-baseline': {'engine': 'i', 'server': {}},
+    'i-latency': {'engine': 'i', 'server': {'latency': 0.05}},
+    'i-bandwidth': {'engine': 'i', 'server': {'bandwidth': 2 * 1024 * 1024}},
+    'i-errors': {'engine': 'i', 'server': {'error_rate': 0.05, 'throttle_rate': 0.05}},
+    'i-large': {'engine': 'i', 'server': {'items': 10, 'media_size': 8 * 1024 * 1024}},
+    'j-baseline': {'engine': 'j', 'server': {}},
+}
+
+class ProgressVar:
+    """Stand-in for the tkinter DoubleVar that j.py reports progress to."""
+    def set(self, value):
+        self.value = value
+
+def percentile(values, pct):
+    """Return the nearest-rank percentile of `values`."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+def peak_rss_kb(field='VmHWM'):
+    """Peak resident set size of this process in KB (or the current one with field='VmRSS').
+
+    Linux carries ru_maxrss across exec, which would report the parent's
+    peak (including the fake server's buffers), so prefer VmHWM there.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_engine(engine, feed_url, output_dir):
+    """Run one engine against `feed_url` and return its measurements."""
+    module = __import__(engine)
+    latencies = []
+    download_media_item = module.download_media_item
+
+    def timed_download_media_item(entry, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return download_media_item(entry, *args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    module.download_media_item = timed_download_media_item
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        media = module.parse_xml(module.fetch_url_content(feed_url))
+        if engine == 'j':
+            module.download_media(media, output_dir, module.MAX_THREADS, ProgressVar())
+        else:
+            module.download_media(media, output_dir)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    files = [os.path.join(output_dir, name) for name in os.listdir(output_dir)]
+    total_bytes = sum(os.path.getsize(path) for path in files)
+    return {
+        'items': len(media),
+        'files': len(files),
+        'bytes': total_bytes,
+        'wall_s': round(wall, 4),
+        'cpu_s': round(cpu, 4),
+        'files_per_s': round(len(files) / wall, 2) if wall else 0.0,
+        'mb_per_s': round(total_bytes / wall / 1e6, 2) if wall else 0.0,
+        'p50_s': round(percentile(latencies, 50), 4),
+        'p99_s': round(percentile(latencies, 99), 4),
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+def run_worker(engine, feed_url):
+    """Child-process entry point: run the engine in a scratch directory and print JSON."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)  # Engines write log and progress files relative to cwd
+        result = run_engine(engine, feed_url, os.path.join(scratch, "media"))
+    print(json.dumps(result))
+
+def run_scenario(name, items=None):
+    """Serve the scenario's data and measure the engine in a fresh interpreter."""
+    scenario = SCENARIOS[name]
+    server_config = dict(scenario['server'])
+    if items is not None:
+        server_config['items'] = items
+    server, base_url = start_server(**server_config)
+    try:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', scenario['engine'], f"{base_url}/feed.xml"],
+            check=True, capture_output=True, text=True,
+        ).stdout
+    finally:
+        server.shutdown()
+        server.server_close()
+    result = json.loads(output.strip().splitlines()[-1])
+    return {'scenario': name, 'engine': scenario['engine'], **server_config, **result}
+
+def synthetic_media(count):
+    """Build `count` feed item dicts shaped like the parser's output, with their own string objects."""
+    kind = 'mpeg'
+    return [{'url': f"https://media.example.com/archive/{n // 1000}/episode-{n}.mp3",
+             'title': f"Episode {n}: a title about as long as real ones get",
+             'type': f"audio/{kind}"} for n in range(count)]
+
+def run_plan_memory_worker(count, mode):
+    """Child-process entry point: plan and run `count` items without downloading, and print JSON.
+
+    'compact' runs i.download_media as is. 'legacy' replays the previous
+    shape of the same work: (item, file_name) tuples and one Future per item
+    submitted up front.
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import i
+    from planner import plan_downloads
+
+    def noop_download(entry, *args):
+        return True, entry
+
+    media = synthetic_media(count)
+    baseline = peak_rss_kb('VmRSS')
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        output_dir = os.path.join(scratch, "media")
+        i.PROBE_BEFORE_DOWNLOAD = False
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            if mode == 'compact':
+                i.download_media_item = noop_download
+                done = len(i.download_media(media, output_dir))
+            else:
+                plan = [(item, entry.file_name) for item, entry in zip(media, plan_downloads(media, output_dir))]
+                with i.ThreadPoolExecutor(max_workers=i.MAX_THREADS) as executor:
+                    futures = {executor.submit(noop_download, item, file_name): item for item, file_name in plan}
+                    done = sum(1 for future in as_completed(futures) if future.result()[0])
+    peak = peak_rss_kb()
+    print(json.dumps({
+        'scenario': f'plan-memory-{mode}',
+        'items': count,
+        'done': done,
+        'wall_s': round(time.perf_counter() - started, 3),
+        'baseline_rss_kb': baseline,
+        'peak_rss_kb': peak,
+        'overhead_kb': peak - baseline,
+    }))
+
+def run_plan_memory(counts=PLAN_MEMORY_ITEMS, modes=PLAN_MEMORY_MODES):
+    """Measure each plan size and mode in a fresh interpreter so peaks don't carry over."""
+    results = []
+    for count in counts:
+        for mode in modes:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--plan-memory-worker', str(count), mode],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+def parse_importtime(stderr):
+    """Return (total import time in ms, top-level package names) from `-X importtime` output."""
+    total_us = 0
+    packages = set()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue  # Header line
+        packages.add(name.strip().split('.')[0])
+        if not name[1:].startswith(' '):  # Nested imports are indented
+            total_us += int(cumulative)
+    return total_us / 1000, packages
+
+def run_startup(runs=STARTUP_RUNS, budget_ms=STARTUP_BUDGET_MS):
+    """Time i.py polling a feed with nothing new, and check heavy modules stay unloaded."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'i.py')
+    server, base_url = start_server(items=5)
+    feed = f"{base_url}/feed.xml\n"
+    walls, imports, loaded = [], [], set()
+    try:
+        with tempfile.TemporaryDirectory() as scratch:
+            # The first run downloads everything; the timed runs are then no-ops
+            subprocess.run([sys.executable, script], input=feed, cwd=scratch, check=True, capture_output=True, text=True)
+            for _ in range(runs):
+                started = time.perf_counter()
+                result = subprocess.run([sys.executable, '-X', 'importtime', script], input=feed, cwd=scratch,
+                                        check=True, capture_output=True, text=True)
+                walls.append((time.perf_counter() - started) * 1000)
+                if "already been downloaded" not in result.stdout:
+                    raise RuntimeError(f"Startup run did work:\n{result.stdout}")
+                import_ms, packages = parse_importtime(result.stderr)
+                imports.append(import_ms)
+                loaded |= packages
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {
+        'scenario': 'startup',
+        'runs': runs,
+        'wall_ms': round(percentile(walls, 50), 1),
+        'import_ms': round(percentile(imports, 50), 1),
+        'budget_ms': budget_ms,
+        'lazy_loaded': sorted(loaded.intersection(LAZY_MODULES)),
+    }
+
+def run_queue(workers=QUEUE_WORKERS, items=QUEUE_ITEMS, lease_timeout=QUEUE_LEASE_TIMEOUT):
+    """Drain a published queue with `workers` i.py processes, killing one mid-lease, and check every item ends done."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'i.py')
+    server, base_url = start_server(items=items, **QUEUE_SERVER)
+    try:
+        with tempfile.TemporaryDirectory() as scratch:
+            queue_path = os.path.join(scratch, 'queue.db')
+            subprocess.run([sys.executable, script, '--coordinator', queue_path, f"{base_url}/feed.xml"],
+                           cwd=scratch, check=True, capture_output=True, text=True)
+            started = time.perf_counter()
+            procs = [subprocess.Popen([sys.executable, script, '--worker', queue_path, '--lease-timeout', str(lease_timeout)],
+                                      cwd=scratch, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                     for _ in range(workers)]
+            victim = procs[0]
+            try:
+                # Kill the first worker only once it holds a lease, so its items have to be reclaimed
+                while time.perf_counter() - started < QUEUE_DEADLINE:
+                    with contextlib.closing(sqlite3.connect(queue_path, timeout=60)) as db:
+                        held = db.execute("SELECT COUNT(*) FROM items WHERE status = 'leased' AND owner LIKE ?",
+                                          (f"%:{victim.pid}:%",)).fetchone()[0]
+                    if held or victim.poll() is not None:
+                        break
+                    time.sleep(0.05)
+                victim.kill()
+                for proc in procs[1:]:
+                    proc.wait(timeout=max(QUEUE_DEADLINE - (time.perf_counter() - started), 1))
+            finally:
+                for proc in procs:
+                    if proc.poll() is None:
+                        proc.kill()
+                        proc.wait()
+            wall = time.perf_counter() - started
+            with contextlib.closing(sqlite3.connect(queue_path)) as db:
+                rows = db.execute("SELECT status, attempts, file_name FROM items").fetchall()
+            statuses = {}
+            for status, _, _ in rows:
+                statuses[status] = statuses.get(status, 0) + 1
+            missing = sum(1 for status, _, file_name in rows
+                          if status == 'done' and not os.path.exists(os.path.join(scratch, file_name)))
+            try:
+                with open(os.path.join(scratch, 'download_progress.json')) as f:
+                    recorded = len(json.load(f)['downloads'])  # Workers record the queue's results there
+            except OSError:
+                recorded = 0
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {
+        'scenario': 'queue-crash',
+        'workers': workers,
+        'items': len(rows),
+        'lease_timeout': lease_timeout,
+        'killed_holding': held,
+        'statuses': statuses,
+        'reclaimed': sum(1 for _, attempts, _ in rows if attempts > 1),
+        'missing_files': missing,
+        'in_progress_file': recorded,
+        'wall_s': round(wall, 2),
+        'ok': bool(rows) and statuses.get('done') == len(rows) == recorded and held > 0 and not missing,
+    }
+
+def run_feed_encoding(items=FEED_ITEMS, runs=FEED_RUNS):
+    """Measure wire bytes and streaming fetch+parse latency of a large feed per Accept-Encoding.
+
+    'default' is the request the downloaders sent before FEED_HEADERS, with requests' own
+    Accept-Encoding; 'preferred' is FEED_HEADERS, which ranks zstd and br first when their decoders
+    are installed.
+    """
+    import requests
+    from feedsync import feed_accept_encoding, iter_feed_items
+
+    server, base_url = start_server(items=items)
+    url = f"{base_url}/feed.xml"
+    results = []
+    try:
+        for name, encoding in (('identity', 'identity'),
+                               ('default', requests.utils.DEFAULT_ACCEPT_ENCODING),
+                               ('preferred', feed_accept_encoding())):
+            requests.get(url, headers={'Accept-Encoding': encoding}).close()  # Let the server build and cache the body
+            timings = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                response = requests.get(url, headers={'Accept-Encoding': encoding}, stream=True)
+                response.raw.decode_content = True
+                parsed = sum(1 for item, _, _ in iter_feed_items(response.raw) if item is not None)
+                timings.append(time.perf_counter() - started)
+                wire_bytes = response.raw.tell()
+                response.close()
+            results.append({
+                'scenario': f'feed-{name}',
+                'items': parsed,
+                'accept_encoding': encoding,
+                'content_encoding': response.headers.get('Content-Encoding', 'identity'),
+                'wire_bytes': wire_bytes,
+                'p50_s': round(percentile(timings, 50), 4),
+            })
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+def main(argv=None):
+    """Run the selected benchmark scenarios and append the results to BENCH_OUTPUT."""
+    parser = argparse.ArgumentParser(description="Benchmark the downloaders against a local fake server.")
+    parser.add_argument('scenarios', nargs='*', help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument('--items', type=int, help="Override the number of feed items")
+    parser.add_argument('--output', default=BENCH_OUTPUT, help="File to append JSON results to")
+    parser.add_argument('--startup', action='store_true',
+                        help=f"Benchmark a no-work poll against a {STARTUP_BUDGET_MS} ms budget instead")
+    parser.add_argument('--feed-encoding', action='store_true',
+                        help="Benchmark wire bytes and parse latency of a large feed per encoding instead")
+    parser.add_argument('--plan-memory', action='store_true',
+                        help="Benchmark peak RSS of planning and running large plans (no network) instead")
+    parser.add_argument('--queue', action='store_true',
+                        help=f"Run {QUEUE_WORKERS} queue workers, kill one mid-lease and check every item ends done instead")
+    parser.add_argument('--worker', nargs=2, metavar=('ENGINE', 'FEED_URL'), help=argparse.SUPPRESS)
+    parser.add_argument('--plan-memory-worker', nargs=2, metavar=('COUNT', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        run_worker(*args.worker)
+        return
+
+    if args.plan_memory_worker:
+        count, mode = args.plan_memory_worker
+        run_plan_memory_worker(int(count), mode)
+        return
+
+    if args.plan_memory:
+        for result in run_plan_memory((args.items,) if args.items else PLAN_MEMORY_ITEMS):
+            print(f"{result['scenario']:20} {result['items']:7d} items  peak rss {result['peak_rss_kb']:8d} KB  "
+                  f"over baseline {result['overhead_kb']:8d} KB  {result['wall_s']:.2f}s")
+            with open(args.output, 'a') as f:
+                f.write(json.dumps(result) + "\n")
+        return
+
+    if args.queue:
+        result = run_queue(items=args.items or QUEUE_ITEMS)
+        print(f"queue-crash: {result['items']} items, {result['workers']} workers (one killed holding "
+              f"{result['killed_holding']} leases), {result['reclaimed']} reclaimed, statuses {result['statuses']}, "
+              f"{result['missing_files']} files missing, {result['in_progress_file']} in the progress file, "
+              f"{result['wall_s']:.1f}s")
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + "\n")
+        if not result['ok']:
+            sys.exit(1)
+        return
+
+    if args.feed_encoding:
+        for result in run_feed_encoding(args.items or FEED_ITEMS):
+            print(f"{result['scenario']:16} {result['items']:6d} items  {result['content_encoding']:8} "
+                  f"{result['wire_bytes']:10d} bytes on the wire  p50 {result['p50_s']:.3f}s")
+            with open(args.output, 'a') as f:
+                f.write(json.dumps(result) + "\n")
+        return
+
+    if args.startup:
+        result = run_startup()
+        print(f"startup: {result['wall_ms']} ms wall, {result['import_ms']} ms importing "
+              f"(budget {result['budget_ms']} ms), lazy modules loaded: {result['lazy_loaded'] or 'none'}")
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + "\n")
+        if result['wall_ms'] > result['budget_ms'] or result['lazy_loaded']:
+            sys.exit(1)
+        return
+
+    for name in args.scenarios or list(SCENARIOS):
+        result = run_scenario(name, args.items)
+        print(f"{name:14} {result['files']:5d} files  {result['files_per_s']:8.2f} files/s  "
+              f"{result['mb_per_s']:8.2f} MB/s  p50 {result['p50_s']:.3f}s  p99 {result['p99_s']:.3f}s  "
+              f"rss {result['peak_rss_kb']} KB  cpu {result['cpu_s']:.2f}s")
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import os
+import tempfile
+import threading
+import time
+
+# Constants
+WRITERS_PER_DEVICE = 2  # Concurrent writes per disk, independent of the number of network threads
+WRITE_BUFFER = 1024 * 1024  # Bytes gathered per file before taking a device slot
+FSYNC_BATCH = 32  # Files renamed into place before their data is fsynced as a group
+STALE_PART_AGE = 24 * 3600  # Seconds after which a leftover staging file is removed
+PART_SUFFIX = '.part'
+
+# mkstemp creates files as 0600; committed files get the usual umask-based mode instead
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+_lock = threading.Lock()
+_device_slots = {}
+_unsynced = []
+
+def device_slot(directory):
+    """Return the semaphore limiting concurrent writers on the device holding `directory`."""
+    device = os.stat(directory).st_dev
+    with _lock:
+        if device not in _device_slots:
+            _device_slots[device] = threading.BoundedSemaphore(WRITERS_PER_DEVICE)
+        return _device_slots[device]
+
+def schedule_sync(path):
+    """Queue a file that was renamed into place for the next batched fsync."""
+    with _lock:
+        _unsynced.append(path)
+        batch_full = len(_unsynced) >= FSYNC_BATCH
+    if batch_full:
+        sync_pending()
+
+def sync_pending():
+    """fsync every file renamed into place since the last sync, then their directories."""
+    with _lock:
+        paths = _unsynced[:]
+        del _unsynced[:]
+    directories = set()
+    for path in paths:
+        directory = os.path.dirname(path) or '.'
+        directories.add(directory)
+        try:
+            with device_slot(directory):
+                fd = os.open(path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+        except FileNotFoundError:
+            pass  # Renamed again since (e.g. a mirror race part); the new name is queued separately
+    if os.name != 'nt':  # Windows can't open directories for fsync
+        for directory in directories:
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+def create_staging_file(file_name):
+    """Create an empty hidden `.<name>.*.part` file next to `file_name`; returns (fd, path).
+
+    remove_stale_parts matches these names and the planner skips them, so
+    one left by a killed run is cleaned up and never takes a file name.
+    """
+    fd, path = tempfile.mkstemp(
+        dir=os.path.dirname(file_name) or '.', prefix=f".{os.path.basename(file_name)[:64]}.", suffix=PART_SUFFIX)
+    os.chmod(path, 0o666 & ~_UMASK)
+    return fd, path
+
+def remove_stale_parts(directory, max_age=STALE_PART_AGE):
+    """Delete staging files left behind by interrupted runs."""
+    if not os.path.isdir(directory):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(directory):
+        if entry.name.startswith('.') and entry.name.endswith(PART_SUFFIX) and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+class StagedFile:
+    """Write to a temp file next to `file_name` and atomically rename it into place on success.
+
+    Writes are buffered and issued in WRITE_BUFFER-sized blocks while holding
+    the device's writer slot, so many network threads turn into a few large
+    sequential writers. Leaving the block with an exception, or after
+    discard(), removes the temp file; the final name only ever holds a
+    complete file.
+    """
+
+    def __init__(self, file_name):
+        directory = os.path.dirname(file_name) or '.'
+        fd, self.temp_name = create_staging_file(file_name)
+        self.file = os.fdopen(fd, 'wb')
+        self.file_name = file_name
+        self.slot = device_slot(directory)
+        self.buffer = bytearray()
+        self.discarded = False
+
+    def write(self, chunk):
+        self.buffer += chunk
+        if len(self.buffer) >= WRITE_BUFFER:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            with self.slot:
+                self.file.write(self.buffer)
+                self.file.flush()
+            self.buffer.clear()
+
+    def discard(self):
+        """Drop the staged data instead of committing it."""
+        self.discarded = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        committed = False
+        try:
+            if exc_type is None and not self.discarded:
+                self.flush()
+                self.file.close()
+                os.replace(self.temp_name, self.file_name)
+                committed = True
+                schedule_sync(self.file_name)
+        finally:
+            if not committed:
+                self.file.close()
+                try:
+                    os.remove(self.temp_name)
+                except OSError:
+                    pass
+        return False
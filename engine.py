@@ -0,0 +1,128 @@
+import time
+from urllib.parse import urlparse
+
+import requests
+
+import profiling
+from bandwidth import limiter
+from diskwriter import StagedFile, sync_pending
+from estimate import record_throughput
+from mirrors import mirror_urls, race_download
+from planner import assigned_names, forget_names, plan_downloads, remember_names
+from probe import forget_probes, order_by_size, parse_length, probe_all
+from state import load_state, save_state
+
+# The download steps shared by the i.py and j.py engines: planning, fetching one item, and settling a run
+
+# Constants
+MAX_RETRIES = 3
+DOWNLOAD_TIMEOUT = (10, 60)  # Seconds to connect, and without a byte mid-transfer, before the attempt fails
+
+# Custom headers to bypass server restrictions
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+def verify_size(response, written):
+    """Raise if fewer or more bytes arrived than the server announced."""
+    expected = parse_length(response.headers.get('Content-Length'))  # None if missing or malformed
+    # With a Content-Encoding, Content-Length counts the encoded bytes rather than what we wrote
+    if expected is not None and not response.headers.get('Content-Encoding') and expected != written:
+        raise requests.exceptions.ChunkedEncodingError(f"Expected {expected} bytes, got {written}")
+
+def fetch_to_file(url, file_name, transfer=None):
+    """Stream `url` into `file_name`, reporting bytes to and stopping on cancel of a mirror race `transfer`."""
+    with profiling.phase('download'):
+        response = requests.get(url, stream=True, headers=HEADERS, timeout=DOWNLOAD_TIMEOUT)
+        if transfer is not None:
+            transfer.response = response  # Lets the race stop a stalled read when cancelling
+            if transfer.cancelled.is_set():
+                response.close()
+                return
+        response.raise_for_status()
+
+        host = urlparse(url).netloc
+        written = 0
+        # Staged in a temp file and renamed into place only once complete and verified
+        with StagedFile(file_name) as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                if chunk:  # Filter out keep-alive chunks
+                    limiter.throttle(host, len(chunk))  # Global/per-host caps from bandwidth.json
+                    with profiling.phase('write'):
+                        f.write(chunk)
+                    written += len(chunk)
+                    if transfer is not None:
+                        transfer.bytes = written
+                        if transfer.cancelled.is_set():
+                            response.close()
+                            f.discard()
+                            return
+            if transfer is not None and transfer.cancelled.is_set():
+                f.discard()  # Stopped by the race while waiting for the next chunk
+                return
+            with profiling.phase('verify'):
+                verify_size(response, written)
+
+def download_media_item(entry, retries=0):
+    """Download a media file to the path chosen for it by the planner."""
+    url = entry.url
+    title = entry.title
+    file_name = entry.file_name
+
+    print(f"Downloading: {title}\nURL: {url}\nSaving to: {file_name}")
+
+    attempt = 0
+    success = False
+
+    # Retry mechanism
+    while attempt < MAX_RETRIES and not success:
+        try:
+            sources = mirror_urls(entry)
+            if len(sources) > 1:
+                # Hedge slow or failing hosts onto the item's mirrors
+                race_download(sources, file_name, fetch_to_file)
+            else:
+                fetch_to_file(url, file_name)
+            print(f"Download successful: {file_name}")
+            success = True
+        except requests.exceptions.RequestException as e:
+            attempt += 1
+            print(f"Error downloading {url}: {e}. Attempt {attempt}/{MAX_RETRIES}")
+            time.sleep(2 ** attempt)  # Exponential backoff
+        except Exception as e:
+            print(f"General error: {e}")
+            break
+
+    return success, entry
+
+def plan_media(media, output_dir, probe=True):
+    """Assign every item its target path and, if `probe`, its size, largest first."""
+    with profiling.phase('plan'):
+        state = load_state()
+        # Names chosen by earlier runs for items not downloaded yet are kept, so they never shift
+        plan = plan_downloads(media, output_dir, assigned_names(state, output_dir))
+        remember_names(state, plan)
+    if probe:
+        with profiling.phase('probe'):
+            probes = probe_all([entry.url for entry in plan], state, HEADERS)
+        for entry in plan:
+            entry.size = probes.get(entry.url, {}).get('size')
+        plan = order_by_size(plan, probes)
+    save_state(state)
+    return plan
+
+def settle_downloads(downloaded, transfers=None):
+    """Make a run's finished downloads durable, then drop their plan names and cached probes.
+
+    `transfers` ({host: [bytes, seconds, files]}) is added to the throughput
+    history that plan estimates use.
+    """
+    # Make the downloads durable before progress records them as done
+    with profiling.phase('write'):
+        sync_pending()
+    state = load_state()
+    if transfers:
+        record_throughput(state, transfers)
+    forget_names(state, [entry.url for entry in downloaded])
+    forget_probes(state, [entry.url for entry in downloaded])
+    save_state(state)
@@ -0,0 +1,119 @@
+from urllib.parse import urlparse
+
+# Constants
+THROUGHPUT_DECAY = 0.5  # Weight kept by earlier runs each time a run's throughput is recorded
+STATUS_ORDER = ('downloaded', 'duplicate', 'on disk', 'to fetch')
+
+def record_throughput(state, transfers):
+    """Fold one run's {host: (bytes, seconds, files)} into the per-host history in `state`.
+
+    Seconds are summed over individual transfers (retries included), so the
+    history holds a per-connection rate that doesn't depend on how many
+    threads the run used. Older runs decay by THROUGHPUT_DECAY so the history
+    follows hosts that get faster or slower.
+    """
+    history = state.setdefault('throughput', {})
+    for host, (size, seconds, files) in transfers.items():
+        previous = history.get(host, {'bytes': 0, 'seconds': 0.0, 'files': 0})
+        history[host] = {
+            'bytes': previous['bytes'] * THROUGHPUT_DECAY + size,
+            'seconds': previous['seconds'] * THROUGHPUT_DECAY + seconds,
+            'files': previous['files'] * THROUGHPUT_DECAY + files,
+        }
+
+def host_history(state, host):
+    """Return (bytes/s per connection, average file size) for `host`, else across all hosts, else (None, None)."""
+    history = state.get('throughput', {})
+    records = [history[host]] if host in history else list(history.values())
+    size = sum(record['bytes'] for record in records)
+    seconds = sum(record['seconds'] for record in records)
+    files = sum(record['files'] for record in records)
+    if not seconds or not files:
+        return None, None
+    return size / seconds, size / files
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def format_duration(seconds):
+    if seconds is None:
+        return "unknown"
+    if seconds < 1:
+        return "<1s"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+def estimate_job(entries, state, threads, global_cap=0, host_cap=None):
+    """Estimate bytes and duration per host for plan entries still to fetch.
+
+    Entries without a probed size count as the host's historical average file
+    size. A host takes its bytes over `threads` connections at the recorded
+    per-connection rate, or longer if its bandwidth cap is lower. Hosts are
+    downloaded one after another, and the whole job never beats `global_cap`.
+    Returns (hosts, total_bytes, seconds), where `hosts` maps each host to a
+    dict and seconds is None when there is no throughput history yet.
+    """
+    hosts = {}
+    for entry in entries:
+        host = hosts.setdefault(urlparse(entry.url).netloc, {'files': 0, 'bytes': 0, 'unknown': 0})
+        host['files'] += 1
+        if entry.size is None:
+            host['unknown'] += 1
+        else:
+            host['bytes'] += entry.size
+
+    total_bytes, seconds = 0, 0.0
+    for name, host in hosts.items():
+        rate, average_size = host_history(state, name)
+        host['rate'] = rate
+        host['estimated_bytes'] = host['bytes'] + host['unknown'] * (average_size or 0)
+        host['seconds'] = None
+        if rate:
+            host['seconds'] = host['estimated_bytes'] / (rate * min(threads, host['files']))
+            cap = host_cap(name) if host_cap else 0
+            if cap:
+                host['seconds'] = max(host['seconds'], host['estimated_bytes'] / cap)
+        total_bytes += host['estimated_bytes']
+        if seconds is not None:
+            seconds = None if host['seconds'] is None else seconds + host['seconds']
+    if seconds is not None and global_cap:
+        seconds = max(seconds, total_bytes / global_cap)
+    return hosts, total_bytes, seconds
+
+def plan_report(counts, on_disk_bytes, entries, state, threads, global_cap=0, host_cap=None):
+    """Format a dry-run plan: item counts by status, bytes to fetch, a per-host breakdown and the estimate."""
+    hosts, total_bytes, seconds = estimate_job(entries, state, threads, global_cap, host_cap)
+    unknown = sum(host['unknown'] for host in hosts.values())
+
+    lines = [f"Plan: {sum(counts.values())} items"]
+    for status in STATUS_ORDER:
+        count = counts.get(status, 0)
+        detail = ""
+        if status == 'on disk' and count:
+            detail = f"  {format_bytes(on_disk_bytes)} (complete files, skipped)"
+        elif status == 'to fetch' and count:
+            detail = f"  {format_bytes(total_bytes)}"
+            if unknown:
+                detail += f" ({unknown} of unknown size counted at the host's average)"
+        lines.append(f"  {status:12} {count:7d}{detail}")
+
+    if hosts:
+        lines.append(f"  {'host':32} {'files':>7} {'bytes':>10} {'rate/conn':>12} {'time':>9}")
+        for name, host in sorted(hosts.items(), key=lambda pair: -pair[1]['estimated_bytes']):
+            rate = f"{format_bytes(host['rate'])}/s" if host['rate'] else "no history"
+            lines.append(f"  {name[:32]:32} {host['files']:7d} {format_bytes(host['estimated_bytes']):>10} "
+                         f"{rate:>12} {format_duration(host['seconds']):>9}")
+    if seconds is None and hosts:
+        lines.append("Estimated duration: unknown (no throughput recorded yet; run a download first)")
+    else:
+        lines.append(f"Estimated duration: {format_duration(seconds)} with {threads} threads")
+    return "\n".join(lines)
@@ -0,0 +1,279 @@
+import gzip
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import escape
+
+# Defaults for the synthetic podcast/HTTP server used by bench.py
+DEFAULT_ITEMS = 50
+DEFAULT_MEDIA_SIZE = 256 * 1024  # Bytes per media file
+CHUNK_SIZE = 16 * 1024
+
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+# Content codings the server can produce; equally weighted codings go to the one the client lists first
+ENCODERS = {}
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        from backports import zstd
+    except ImportError:
+        zstd = None
+if zstd is not None:
+    ENCODERS['zstd'] = zstd.compress
+try:
+    import brotli
+    ENCODERS['br'] = brotli.compress
+except ImportError:
+    pass
+ENCODERS['gzip'] = lambda body: gzip.compress(body, 6)
+
+def default_config():
+    """Return the default server configuration."""
+    return {
+        'items': DEFAULT_ITEMS,          # Items in the feed / rows in the HTML table
+        'media_size': DEFAULT_MEDIA_SIZE,
+        'latency': 0.0,                  # Seconds before the first byte of every response
+        'bandwidth': 0,                  # Bytes per second per response, 0 = unlimited
+        'error_rate': 0.0,               # Fraction of media requests answered with a 500
+        'throttle_rate': 0.0,            # Fraction of media requests answered with a 429
+        'ranges': True,                  # Honour Range requests on media
+        'compress': True,                # Compress feeds and index pages (zstd, br or gzip) for clients that accept it
+        'seed': 0,
+    }
+
+def media_payload(index, size):
+    """Build the deterministic body of media file `index`."""
+    pattern = f"media-{index:06d};".encode()
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+def build_feed(base_url, items, media_size, page=1, page_size=0, atom=False):
+    """Build a synthetic RSS (or Atom) feed with one enclosure per item.
+
+    With `page_size`, only page `page` is returned and RFC 5005 next/last
+    links point at the other pages.
+    """
+    first, end, pages = 0, items, 1
+    if page_size:
+        pages = max(-(-items // page_size), 1)
+        first, end = (page - 1) * page_size, min(page * page_size, items)
+    path = 'atom.xml' if atom else 'feed.xml'
+    links = []
+    if page_size:
+        page_url = f"{base_url}/{path}?items={items}&amp;page_size={page_size}&amp;page="
+        if page < pages:
+            links.append(f'<atom:link rel="next" href="{page_url}{page + 1}"/>')
+        links.append(f'<atom:link rel="last" href="{page_url}{pages}"/>')
+
+    if atom:
+        parts = ['<?xml version="1.0" encoding="UTF-8"?>',
+                 '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:atom="http://www.w3.org/2005/Atom">',
+                 '<title>Synthetic feed</title>', *links]
+    else:
+        parts = ['<?xml version="1.0" encoding="UTF-8"?>',
+                 '<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">',
+                 '<channel><title>Synthetic feed</title>', *links]
+    for n in range(first, end):
+        url = f"{base_url}/media/{n}.mp3"
+        if atom:
+            parts.append(
+                f'<entry><title>Episode {n}</title><id>episode-{n}</id>'
+                f'<updated>{time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(1600000000 - n * 86400))}</updated>'
+                f'<summary>{escape(f"Synthetic episode {n}")}</summary>'
+                f'<link rel="enclosure" href="{url}" length="{media_size}" type="audio/mpeg"/>'
+                f'</entry>'
+            )
+        else:
+            parts.append(
+                f'<item><title>Episode {n}</title>'
+                f'<guid>episode-{n}</guid>'
+                f'<pubDate>{time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime(1600000000 - n * 86400))}</pubDate>'
+                f'<description>{escape(f"Synthetic episode {n}")}</description>'
+                f'<enclosure url="{url}" length="{media_size}" type="audio/mpeg"/>'
+                f'</item>'
+            )
+    parts.append('</feed>' if atom else '</channel></rss>')
+    return '\n'.join(parts).encode()
+
+def build_index(base_url, items, page=1, page_size=0):
+    """Build a synthetic HTML page with a table laid out like the a.py/b.py source.
+
+    With `page_size`, the table is split into pages linked like a forum
+    thread: <link rel="next"/"last"> in the head and a pager below the table.
+    """
+    first, end, pages = 0, items, 1
+    if page_size:
+        pages = max(-(-items // page_size), 1)
+        first, end = (page - 1) * page_size, min(page * page_size, items)
+    links, pager = [], []
+    if page_size:
+        page_url = f"{base_url}/index.html?items={items}&amp;page_size={page_size}&amp;page="
+        if page < pages:
+            links.append(f'<link rel="next" href="{page_url}{page + 1}">')
+            pager.append(f'<a rel="next" href="{page_url}{page + 1}">Next</a>')
+        links.append(f'<link rel="last" href="{page_url}{pages}">')
+        pager.append(f'<a rel="last" href="{page_url}{pages}">Last</a>')
+    parts = ['<html><head><title>Synthetic index</title>', *links, '</head><body>',
+             '<nav>' + ''.join(f'<a href="/c/{n}">Category {n}</a>' for n in range(50)) + '</nav>',
+             '<table>',
+             '<tr><th>Tape</th><th>Date</th><th>Title</th><th>Length</th></tr>']
+    for n in range(first, end):
+        parts.append(
+            f'<tr><td><a href="{base_url}/media/{n}.mp3">{n}</a></td>'
+            f'<td>2000-01-01</td><td>Episode {n}</td><td>60:00</td></tr>'
+        )
+    parts.append('</table>')
+    parts.append(f'<div class="pager">{"".join(pager)}</div></body></html>')
+    return '\n'.join(parts).encode()
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Serve feeds, index pages and media according to `server.config`."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body):
+        config = self.server.config
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        items = int(query.get('items', [config['items']])[0])
+        base_url = f"http://{self.headers.get('Host', '127.0.0.1')}"
+
+        if config['latency']:
+            time.sleep(config['latency'])
+
+        if parsed.path in ('/feed.xml', '/atom.xml'):
+            atom = parsed.path == '/atom.xml'
+            body = build_feed(base_url, items, config['media_size'],
+                              page=int(query.get('page', [1])[0]),
+                              page_size=int(query.get('page_size', [0])[0]),
+                              atom=atom)
+            self.send_document(body, 'application/atom+xml' if atom else 'application/rss+xml', send_body)
+        elif parsed.path == '/index.html':
+            body = build_index(base_url, items,
+                               page=int(query.get('page', [1])[0]),
+                               page_size=int(query.get('page_size', [0])[0]))
+            self.send_document(body, 'text/html; charset=utf-8', send_body)
+        elif parsed.path.startswith('/media/'):
+            self.send_media(parsed.path, send_body)
+        else:
+            self.send_body(404, b'not found', 'text/plain', send_body)
+
+    def choose_coding(self):
+        """Pick the client's highest-weighted coding among ENCODERS, or None for identity."""
+        weights = {}
+        for part in self.headers.get('Accept-Encoding', '').split(','):
+            coding, _, params = part.partition(';')
+            q = 1.0
+            if params.strip().startswith('q='):
+                try:
+                    q = float(params.strip()[2:])
+                except ValueError:
+                    q = 0.0
+            weights.setdefault(coding.strip().lower(), q)
+        ranked = [(q, -index, coding) for index, (coding, q) in enumerate(weights.items())
+                  if coding in ENCODERS and q > 0]
+        return max(ranked)[2] if ranked else None
+
+    def send_document(self, body, content_type, send_body):
+        """Send a feed or page, compressed with the best coding the client accepts."""
+        headers = {'Vary': 'Accept-Encoding'}
+        coding = self.choose_coding() if self.server.config['compress'] else None
+        if coding:
+            key = (self.path, self.headers.get('Host'), coding)
+            with self.server.lock:
+                compressed = self.server.encoded_cache.get(key)
+            if compressed is None:
+                compressed = ENCODERS[coding](body)
+                with self.server.lock:
+                    self.server.encoded_cache[key] = compressed
+            body = compressed
+            headers['Content-Encoding'] = coding
+        self.send_body(200, body, content_type, send_body, headers)
+
+    def send_media(self, path, send_body):
+        config = self.server.config
+        match = re.match(r'/media/(\d+)\.\w+$', path)
+        if not match:
+            self.send_body(404, b'not found', 'text/plain', send_body)
+            return
+        with self.server.lock:
+            roll = self.server.random.random()
+        if roll < config['throttle_rate']:
+            self.send_body(429, b'slow down', 'text/plain', send_body, {'Retry-After': '1'})
+            return
+        if roll < config['throttle_rate'] + config['error_rate']:
+            self.send_body(500, b'synthetic failure', 'text/plain', send_body)
+            return
+
+        size = config['media_size']
+        payload = media_payload(int(match.group(1)), size)
+        headers = {'ETag': f'"media-{match.group(1)}-{size}"'}
+        if config['ranges']:
+            headers['Accept-Ranges'] = 'bytes'
+        range_header = self.headers.get('Range')
+        range_match = RANGE_RE.match(range_header or '')
+        if config['ranges'] and range_match:
+            start, end = range_match.groups()
+            if start:
+                start, end = int(start), min(int(end) if end else size - 1, size - 1)
+            else:
+                start, end = max(size - int(end), 0), size - 1
+            if start >= size or start > end:
+                self.send_body(416, b'', 'text/plain', send_body, {'Content-Range': f'bytes */{size}'})
+                return
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            self.send_body(206, payload[start:end + 1], 'audio/mpeg', send_body, headers)
+        else:
+            self.send_body(200, payload, 'audio/mpeg', send_body, headers)
+
+    def send_body(self, status, body, content_type, send_body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if not send_body:
+            return
+        bandwidth = self.server.config['bandwidth']
+        try:
+            for offset in range(0, len(body), CHUNK_SIZE):
+                chunk = body[offset:offset + CHUNK_SIZE]
+                self.wfile.write(chunk)
+                if bandwidth:
+                    time.sleep(len(chunk) / bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client went away mid-transfer
+
+def start_server(host='127.0.0.1', port=0, **config):
+    """Start the fake server in a background thread and return (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), FakeHandler)
+    server.daemon_threads = True
+    server.config = default_config()
+    server.config.update(config)
+    server.random = random.Random(server.config['seed'])
+    server.lock = threading.Lock()
+    server.encoded_cache = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    server, base_url = start_server(port=8000)
+    print(f"Serving {base_url}/feed.xml, {base_url}/atom.xml and {base_url}/index.html (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
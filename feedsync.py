@@ -0,0 +1,364 @@
+import io
+import re
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin
+
+# Constants
+FULL_SCAN_INTERVAL = 7 * 24 * 3600  # Re-read whole feeds this often to catch reordered or backdated items
+ARCHIVE_THREADS = 8  # Concurrent fetches of paged/archived feed pages
+MAX_ARCHIVE_PAGES = 1000
+MAX_RETRY_POLLS = 5  # Polls that keep returning an item whose download failed before giving up on it
+
+# Namespaces
+ATOM = '{http://www.w3.org/2005/Atom}'
+MEDIA = '{http://search.yahoo.com/mrss/}'
+DC = '{http://purl.org/dc/elements/1.1/}'
+
+ITEM_TAGS = {'item', ATOM + 'entry', '{http://purl.org/rss/1.0/}item'}
+PAGE_RELS = ('next', 'prev-archive', 'last')  # RFC 5005 paged and archived feeds
+FOLLOW_RELS = ('next', 'prev-archive')  # Both point at older entries
+
+NUMBER_RE = re.compile(r'(\d+)')
+
+# Content codings for feeds and index pages, most preferred first, with their q-values
+CODING_PREFERENCE = (('zstd', '1.0'), ('br', '0.9'), ('gzip', '0.8'), ('deflate', '0.5'))
+
+def feed_accept_encoding():
+    """Build an Accept-Encoding preferring zstd, then br, over gzip, offering only codings urllib3 can decode here.
+
+    zstd and br need the optional backports.zstd (or Python 3.14) and brotli
+    packages. Without them this offers the same gzip and deflate as requests'
+    default header, only with gzip ranked first.
+    """
+    from urllib3.util.request import ACCEPT_ENCODING
+
+    available = ACCEPT_ENCODING.split(',')
+    return ', '.join(f"{coding};q={q}" for coding, q in CODING_PREFERENCE if coding in available)
+
+def close_source(source):
+    """Close a page that was handed over as a stream; bytes need nothing."""
+    close = getattr(source, 'close', None)
+    if close is not None:
+        close()
+
+def _close_result(future):
+    if not future.cancelled() and future.exception() is None:
+        close_source(future.result())
+
+class PageQueue:
+    """Further pages to read in order, fetched at most `window` pages ahead of the reader.
+
+    `fetch` may return an open stream, which holds its connection until the
+    page is read, so later pages are only submitted as earlier ones are taken.
+    """
+
+    def __init__(self, executor, fetch, window, seen=(), limit=MAX_ARCHIVE_PAGES):
+        self.executor = executor
+        self.fetch = fetch
+        self.window = window
+        self.limit = limit
+        self.scheduled = set(seen)
+        self.waiting = deque()
+        self.fetching = deque()  # (url, future), in reading order
+
+    def add(self, url):
+        """Queue `url` unless it was queued before or `limit` pages already were."""
+        if url not in self.scheduled and len(self.scheduled) < self.limit:
+            self.scheduled.add(url)
+            self.waiting.append(url)
+            self.fill()
+
+    def fill(self):
+        while self.waiting and len(self.fetching) < self.window:
+            url = self.waiting.popleft()
+            self.fetching.append((url, self.executor.submit(self.fetch, url)))
+
+    def take(self):
+        """Return (url, future) of the next page and start fetching another."""
+        page = self.fetching.popleft()
+        self.fill()
+        return page
+
+    def close(self):
+        """Drop the pages not taken yet, closing those that arrive as streams."""
+        self.waiting.clear()
+        for _, future in self.fetching:
+            future.cancel()
+            future.add_done_callback(_close_result)  # Runs now if the fetch already finished
+        self.fetching.clear()
+
+    def __bool__(self):
+        return bool(self.fetching)
+
+def parse_pubdate(value):
+    """Convert an RFC 822 or ISO 8601 date to a Unix timestamp, or None if it can't be parsed."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            date = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+def entry_fields(element):
+    """Extract (item, guid, timestamp) from an RSS <item> or Atom <entry>.
+
+    Further enclosures and media:content URLs of the same type as the first
+    one are kept as `mirrors` for the download to fall back on.
+    """
+    if element.tag == ATOM + 'entry':
+        candidates = [(link.get('href'), link.get('type', '')) for link in element.findall(ATOM + 'link')
+                      if link.get('rel') == 'enclosure' and link.get('href')]
+        guid = element.findtext(ATOM + 'id')
+        date = element.findtext(ATOM + 'published') or element.findtext(ATOM + 'updated')
+        title = element.findtext(ATOM + 'title', '')
+    else:
+        candidates = [(enclosure.get('url'), enclosure.get('type', '')) for enclosure in element.findall('enclosure')
+                      if enclosure.get('url')]
+        guid = element.findtext('guid')
+        date = element.findtext('pubDate') or element.findtext(DC + 'date')
+        title = element.findtext('title') or element.findtext('{http://purl.org/rss/1.0/}title', '')
+    # media:content, directly or inside a media:group
+    candidates += [(content.get('url'), content.get('type', '')) for content in element.iter(MEDIA + 'content')
+                   if content.get('url')]
+
+    item, url = None, ''
+    if candidates:
+        url, mime_type = candidates[0][0].strip(), candidates[0][1]
+        item = {'url': url, 'title': title.strip(), 'type': mime_type}
+        mirrors = [
+            alternate.strip() for alternate, alternate_type in candidates[1:]
+            if alternate.strip() != url and (not alternate_type or not mime_type or alternate_type == mime_type)
+        ]
+        if mirrors:
+            item['mirrors'] = list(dict.fromkeys(mirrors))
+    return item, (guid or url).strip(), parse_pubdate(date)
+
+def iter_feed_items(source, on_page_link=None):
+    """Stream (item, guid, timestamp) from an RSS or Atom document without building the whole tree.
+
+    `source` is bytes or a binary file object. Each item/entry is cleared once
+    read, so memory stays flat however long the feed is. Feed-level
+    next/prev-archive/last links are passed to `on_page_link(rel, href)` as
+    soon as they are parsed, which is usually before the first entry.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    depth = 0  # How many item/entry elements we are inside
+    for event, element in ET.iterparse(source, events=('start', 'end')):
+        if element.tag in ITEM_TAGS:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            fields = entry_fields(element)
+            element.clear()
+            yield fields
+        elif event == 'end' and not depth and element.tag == ATOM + 'link' and on_page_link:
+            rel, href = element.get('rel'), element.get('href')
+            if rel in PAGE_RELS and href:
+                on_page_link(rel, href)
+
+def numbered_pages(next_url, last_url):
+    """List the page URLs from `next_url` to `last_url` if they differ only by one page number."""
+    next_parts, last_parts = NUMBER_RE.split(next_url), NUMBER_RE.split(last_url)
+    if len(next_parts) != len(last_parts):
+        return []
+    differing = [i for i, (a, b) in enumerate(zip(next_parts, last_parts)) if a != b]
+    if len(differing) != 1 or differing[0] % 2 == 0:  # Odd indexes hold the numbers
+        return []
+    index = differing[0]
+    first, last = int(next_parts[index]), int(last_parts[index])
+    if not first < last <= first + MAX_ARCHIVE_PAGES:
+        return []
+    return [''.join(next_parts[:index] + [str(n)] + next_parts[index + 1:]) for n in range(first, last + 1)]
+
+class FeedScan:
+    """Where one sync_feed pass over a feed stands between pages.
+
+    Small and picklable, so a worker process can read a page with it and
+    hand it back for the next one, while the caller keeps the items and
+    fetches the pages (see parsepool.fetch_and_parse).
+    """
+    __slots__ = ('feed_url', 'mark', 'now', 'full_scan', 'ordered', 'previous', 'newest_guid', 'newest_time',
+                 'scanned', 'pages_read', 'complete', 'stopped')
+
+    def __init__(self, feed_url, mark, now=None):
+        self.feed_url = feed_url
+        self.mark = mark
+        self.now = time.time() if now is None else now
+        self.full_scan = (mark is None or not mark.get('ordered', True)
+                          or self.now - mark.get('full_scan', 0) >= FULL_SCAN_INTERVAL)
+        self.ordered = True  # No item so far is newer than the one before it
+        self.previous = None
+        self.newest_guid, self.newest_time = None, None
+        self.scanned = 0
+        self.pages_read = 0
+        self.complete = True  # Cleared by the caller when a page can't be fetched
+        self.stopped = False
+
+    def read_page(self, source, page_url, follow=None):
+        """Return the new items on one page of the feed, stopping at the mark unless this is a full scan.
+
+        `follow(url)` is given the further pages to read: on a full scan as
+        soon as their link is parsed (from the first page also every numbered
+        page up to its `last` link), otherwise the next page once this one is
+        exhausted without reaching the mark.
+        """
+        self.pages_read += 1
+        first_page = self.pages_read == 1
+        mark = self.mark
+        links = {}
+
+        def on_page_link(rel, href):
+            links[rel] = urljoin(page_url, href)
+            # Prefetching only pays off when we know we will read the whole archive
+            if not self.full_scan:
+                return
+            if rel in FOLLOW_RELS:
+                follow(links[rel])
+            if first_page and 'next' in links and 'last' in links:
+                for url in numbered_pages(links['next'], links['last']):
+                    follow(url)
+
+        items = []
+        for item, guid, timestamp in iter_feed_items(source, on_page_link if follow else None):
+            if timestamp is not None:
+                if self.previous is not None and timestamp > self.previous:
+                    # Not newest-first, so stopping early could miss items: read the rest of the feed
+                    self.ordered = False
+                    self.full_scan = True
+                self.previous = timestamp
+            if self.newest_guid is None or (timestamp is not None and (
+                    self.newest_time is None or timestamp > self.newest_time)):
+                self.newest_guid, self.newest_time = guid, timestamp
+
+            if not self.full_scan and (guid == mark['guid'] or (
+                    timestamp is not None and mark['time'] is not None and timestamp < mark['time'])):
+                if self.scanned or guid == mark['guid']:
+                    self.stopped = True
+                    break
+                # Even the first item is older than the mark: likely oldest-first, so read it all
+                self.full_scan = True
+            self.scanned += 1
+            if item is not None:
+                items.append(item)
+
+        if follow and not self.stopped:
+            for rel in FOLLOW_RELS:
+                if rel in links:
+                    follow(links[rel])
+        return items
+
+    def finish(self, items):
+        """Report the scan and return (`items` plus earlier failures to retry, the feed's new mark)."""
+        mark = self.mark or {}
+        new_mark = self.mark
+        retry = mark.get('retry', [])
+        if self.newest_guid is not None:
+            newest_guid, newest_time = self.newest_guid, self.newest_time
+            if mark.get('time') is not None and (newest_time is None or newest_time < mark['time']):
+                newest_guid, newest_time = mark['guid'], mark['time']  # Never move the mark backwards
+            # A full scan only counts if every page was read
+            counted = self.full_scan and self.complete
+            new_mark = {
+                'guid': newest_guid,
+                'time': newest_time,
+                'full_scan': self.now if counted else mark.get('full_scan', 0),
+                'ordered': self.ordered if counted else mark.get('ordered', True),
+                'retry': retry,
+            }
+        kind = "full scan" if self.full_scan else "incremental"
+        print(f"Found {len(items)} new media files ({kind}, read {self.scanned} items from {self.pages_read} pages).")
+        if retry:
+            urls = {item['url'] for item in items}
+            retry_items = [item for item, _ in retry if item['url'] not in urls]
+            print(f"Retrying {len(retry_items)} media files that failed on earlier polls.")
+            items = items + retry_items
+        return items, new_mark
+
+def sync_feed(feed_url, source, state, fetch=None, now=None, max_threads=ARCHIVE_THREADS):
+    """Return only the items published since the feed's high-water mark in `state`.
+
+    For a newest-first feed the scan stops at the first already-seen GUID or
+    the first item older than the mark. If the feed turns out not to be in
+    date order, or the last full scan is older than FULL_SCAN_INTERVAL, the
+    whole feed is read and every item is returned for the progress check to
+    filter. A full scan records on the mark whether the feed was
+    newest-first; feeds that were not (e.g. oldest-first ones, whose first
+    item is already older than the mark) are read in full on every poll.
+    Items whose download failed on earlier polls (see commit_mark) are
+    returned again. The mark is updated in `state`; the caller saves it with
+    commit_mark once the items are downloaded, so a failed or interrupted
+    run never hides items behind the mark.
+
+    With `fetch`, RFC 5005 paged and archived feeds are followed page by
+    page; `fetch` may return bytes or a stream to parse as it arrives. On a
+    full scan pages are fetched in the background as soon as their link is
+    parsed, and when the first page names a numbered `last` page every page
+    in between is queued, so archives download `max_threads` pages ahead of
+    the parser. Incremental polls only fetch the next page once the current
+    one is exhausted without reaching the mark.
+    """
+    feeds = state.setdefault('feeds', {})
+    scan = FeedScan(feed_url, feeds.get(feed_url), now)
+    executor = ThreadPoolExecutor(max_workers=max_threads) if fetch else None
+    pages = PageQueue(executor, fetch, max_threads, seen=(feed_url,)) if fetch else None
+
+    items = []
+    page_url = feed_url
+    try:
+        while True:
+            try:
+                items += scan.read_page(source, page_url, pages.add if fetch else None)
+            finally:
+                if page_url != feed_url:
+                    close_source(source)  # The first page belongs to the caller
+            if scan.stopped or not pages:
+                break
+            page_url, future = pages.take()
+            try:
+                source = future.result()
+            except Exception as e:
+                print(f"Error fetching feed page {page_url}: {e}")
+                scan.complete = False
+                break
+    finally:
+        if executor:
+            pages.close()  # Prefetched pages that were never read
+            executor.shutdown(wait=False)
+
+    items, mark = scan.finish(items)
+    if mark is not None:
+        feeds[feed_url] = mark
+    return items
+
+def commit_mark(state, feed_url, mark, failed):
+    """Save the high-water mark that sync_feed computed, once its items have been downloaded.
+
+    `mark` is the feed's entry from the state sync_feed ran on and `failed`
+    the item dicts that didn't download; they are returned by the next
+    polls until they succeed or have failed MAX_RETRY_POLLS times.
+    """
+    if mark is None:
+        return
+    attempts = {item['url']: count for item, count in mark.get('retry', [])}
+    retry = []
+    for item in failed:
+        count = attempts.get(item['url'], 0) + 1
+        if count < MAX_RETRY_POLLS:
+            retry.append([item, count])
+        else:
+            print(f"Giving up on {item['url']} after {count} polls.")
+    state.setdefault('feeds', {})[feed_url] = {**mark, 'retry': retry}
@@ -1,108 +1,111 @@
+import argparse
 import os
 import requests
-import xml.etree.ElementTree as ET
 from urllib.parse import urlparse
-import re
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 import json
+from collections import Counter
+import profiling
+from planner import DONE, FAILED, PlannedItem, forget_names, run_plan
+from engine import HEADERS, download_media_item, plan_media, settle_downloads
+from diskwriter import remove_stale_parts, sync_pending
+from bandwidth import limiter
+from probe import make_session
+from state import load_state, save_state
+from feedsync import commit_mark, feed_accept_encoding, iter_feed_items, sync_feed
+from estimate import plan_report
+
+# tqdm and the process-pool parser (multiprocessing, BeautifulSoup) are imported
+# inside the functions that use them, so a poll with nothing new starts fast
 
 # Constants
 OUTPUT_DIR = "./media"
 LOG_FILE = "./log.txt"
-MAX_RETRIES = 3
 MAX_THREADS = 4  # Optimal number of simultaneous downloads
+QUEUED_PER_THREAD = 4  # Plan entries submitted ahead of each thread; bounds in-flight futures on huge plans
+PROBE_BEFORE_DOWNLOAD = True  # Collect sizes/range support up front (cached in the state file)
 
-# Custom headers to bypass server restrictions
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-}
+# Feeds and index pages compress 5-10x; prefer zstd and br over gzip when their decoders are installed
+FEED_HEADERS = {**HEADERS, 'Accept-Encoding': feed_accept_encoding()}
 
-# Function to sanitize file names by removing or replacing invalid characters
-def sanitize_filename(filename):
-    return re.sub(r'[\\/*?:"<>|]', '_', filename)
+def fetch_url_content(url, session=None):
+    """Fetch content from a URL with custom headers, reusing `session`'s connections if given."""
+    print(f"Fetching XML from: {url}")
+    with profiling.phase('fetch'):
+        response = (session or requests).get(url, headers=FEED_HEADERS)
+        response.raise_for_status()
+        return response.content
 
-def fetch_url_content(url):
-    """Fetch content from a URL with custom headers."""
+def open_url_stream(url, session=None):
+    """Open a URL for streaming; reading `response.raw` decompresses incrementally as bytes arrive."""
     print(f"Fetching XML from: {url}")
-    response = requests.get(url, headers=HEADERS)
-    response.raise_for_status()
-    return response.content
+    with profiling.phase('fetch'):
+        response = (session or requests).get(url, headers=FEED_HEADERS, stream=True)
+        response.raise_for_status()
+        response.raw.decode_content = True
+        return response
+
+def open_page(url, session=None):
+    """Open a further feed or index page for parsing while it downloads and decompresses."""
+    return open_url_stream(url, session).raw
 
 def parse_xml(content):
     """Extract media links and metadata from XML."""
     print("Parsing XML content...")
-    tree = ET.fromstring(content)
-    items = []
-    for item in tree.findall('channel/item'):
-        title = item.findtext('title', '').strip()
-        enclosure = item.find('enclosure')
-        if enclosure is not None:
-            url = enclosure.get('url', '').strip()
-            if url:
-                items.append({
-                    'url': url,
-                    'title': title,
-                })
+    with profiling.phase('parse'):
+        # Handles RSS enclosures, Atom enclosure links and media:content
+        items = [item for item, _, _ in iter_feed_items(content) if item is not None]
     print(f"Found {len(items)} media files.")
     return items
 
-def download_media_item(item, output_dir, retries=0):
-    """Download a media file and save it to the specified directory."""
-    url = item['url']
-    title = item['title']
-    sanitized_title = sanitize_filename(title)  # Sanitize the title to avoid invalid characters in the filename
-    
-    # Ensure the file path is safe for Windows
-    file_name = os.path.join(output_dir, f"{sanitized_title}.mp3" if '.mp3' in url else os.path.basename(url))
-    
-    print(f"Downloading: {title}\nURL: {url}\nSaving to: {file_name}")
-    
-    attempt = 0
-    success = False
-    
-    # Retry mechanism
-    while attempt < MAX_RETRIES and not success:
-        try:
-            response = requests.get(url, stream=True, headers=HEADERS)
-            response.raise_for_status()
-            
-            with open(file_name, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:  # Filter out keep-alive chunks
-                        f.write(chunk)
-            print(f"Download successful: {file_name}")
-            success = True
-        except requests.exceptions.RequestException as e:
-            attempt += 1
-            print(f"Error downloading {url}: {e}. Attempt {attempt}/{MAX_RETRIES}")
-            time.sleep(2 ** attempt)  # Exponential backoff
-        except Exception as e:
-            print(f"General error: {e}")
-            break
-    
-    return success, item
+def timed_download(entry):
+    """Run download_media_item and also return how long the transfer (with retries) took."""
+    started = time.monotonic()
+    success, entry = download_media_item(entry)
+    return success, entry, time.monotonic() - started
 
 def download_media(media, output_dir):
-    """Download media files using parallel threads with progress tracking."""
+    """Download media files using parallel threads with progress tracking; returns the items that succeeded."""
+    from tqdm import tqdm
+
     os.makedirs(output_dir, exist_ok=True)
-    total_files = len(media)
+    remove_stale_parts(output_dir)
+    present = []
+    plan = []
+    for entry in plan_media(media, output_dir, PROBE_BEFORE_DOWNLOAD):
+        (present if entry.on_disk() else plan).append(entry)
+    if present:
+        print(f"Skipping {len(present)} files already on disk.")
+    total_files = len(plan)
+    status = bytearray(total_files)  # One byte per entry instead of a Future->item map
+    transfers = {}  # host -> [bytes, seconds, files] of this run, for plan estimates
     
     # Initialize progress bar
     with tqdm(total=total_files, desc="Downloading", unit="file") as pbar:
         with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-            futures = {executor.submit(download_media_item, item, output_dir): item for item in media}
-            
-            for future in as_completed(futures):
-                item = futures[future]
-                success, item = future.result()
+            for index, (success, entry, seconds) in run_plan(executor, timed_download, plan,
+                                                             MAX_THREADS * QUEUED_PER_THREAD):
+                status[index] = DONE if success else FAILED
                 pbar.update(1)  # Update progress bar
+                if success:
+                    try:
+                        size = os.path.getsize(entry.file_name)
+                    except OSError:
+                        size = entry.size or 0
+                    totals = transfers.setdefault(urlparse(entry.url).netloc, [0, 0.0, 0])
+                    totals[0] += size
+                    totals[1] += seconds
+                    totals[2] += 1
                 
                 # Log result
                 if not success:
                     with open(LOG_FILE, 'a') as log:
-                        log.write(f"Failed to download: {item['title']} - {item['url']}\n")
+                        log.write(f"Failed to download: {entry.title} - {entry.url}\n")
+    
+    downloaded = present + [entry for entry, code in zip(plan, status) if code == DONE]
+    settle_downloads(downloaded, transfers)
+    return [entry.as_item() for entry in downloaded]
 
 def save_progress(media, filename="download_progress.json"):
     """Save download progress to a file."""
@@ -117,28 +120,242 @@ def load_progress(filename="download_progress.json"):
             return json.load(f).get("downloads", [])
     return []
 
-def main(url):
-    """Main function to handle XML sources and download media."""
-    try:
-        content = fetch_url_content(url)
-        media = parse_xml(content)
+def fetch_new_media(url, table=None):
+    """Fetch a feed and return (items new since the last poll, output directory for its host, new mark).
 
-        # Create output directory based on the host
-        parsed_url = urlparse(url)
-        host_dir = os.path.join(OUTPUT_DIR, parsed_url.netloc)
+    The feed's high-water mark is not saved here: pass the returned mark to
+    commit_poll once the items are downloaded (a dry run never does). With a
+    `table` config (see tablescrape.py) `url` is an HTML page whose table
+    rows, across all its pages, are the items, and the mark is None.
+    """
+    session = make_session(HEADERS)
+    parsed_url = urlparse(url)
+    host_dir = os.path.join(OUTPUT_DIR, parsed_url.netloc)
+    if table is not None:
+        from tablescrape import scrape_table
 
-        # Load previous progress (if available) and resume from where we left off
+        print("Parsing HTML table...")
+        with profiling.phase('parse'):
+            media = scrape_table(url, lambda page_url: open_page(page_url, session), table)
+        return media, host_dir, None
+
+    response = open_url_stream(url, session)
+
+    # Parse straight off the (decompressing) socket and only as far as the newest item
+    # seen on the previous run; paged/archived feeds have their remaining pages fetched
+    # over the pooled session. Parse time here includes reading the body.
+    print("Parsing XML content...")
+    with profiling.phase('parse'):
+        state = load_state()
+        try:
+            media = sync_feed(url, response.raw, state, fetch=lambda page_url: open_page(page_url, session))
+        finally:
+            response.close()  # After an early stop the rest of the feed is never downloaded
+    return media, host_dir, state['feeds'].get(url)
+
+def commit_poll(url, mark, media, downloaded):
+    """Save the feed's new mark, keeping the items of `media` missing from `downloaded` for the next poll."""
+    done_urls = {item['url'] for item in downloaded}
+    state = load_state()
+    commit_mark(state, url, mark, [item for item in media if item['url'] not in done_urls])
+    save_state(state)
+
+def collect_new_media(url, table=None):
+    """Fetch a feed (or table pages) and return (progress, items not downloaded yet, output directory, new mark)."""
+    media, host_dir, mark = fetch_new_media(url, table=table)
+
+    # Load previous progress (if available) and resume from where we left off
+    with profiling.phase('plan'):
         progress = load_progress()
-        remaining_media = [item for item in media if item not in progress]
+        done_urls = {entry['url'] for entry in progress}
+        remaining_media = [item for item in media if item['url'] not in done_urls]
+    return progress, remaining_media, host_dir, mark
+
+def main(url, table=None):
+    """Main function to handle XML sources (or HTML tables, given a `table` config) and download media."""
+    try:
+        progress, remaining_media, host_dir, mark = collect_new_media(url, table)
         
         if remaining_media:
-            download_media(remaining_media, host_dir)
-            save_progress(media)  # Save progress after download completion
+            downloaded = download_media(remaining_media, host_dir)
+            # Incremental polls only return new items, so add to the progress rather than replace it
+            save_progress(progress + downloaded)  # Save progress after download completion
         else:
+            downloaded = []
             print("All media files have already been downloaded.")
+        # Only now may the mark move past these items; failed ones come back on the next poll
+        commit_poll(url, mark, remaining_media, downloaded)
     except Exception as e:
         print(f"An error occurred: {e}")
 
+def main_many(urls):
+    """Refresh several feeds at once, parsing them in a process pool."""
+    from parsepool import fetch_and_parse
+
+    try:
+        # Fetching (including further archive pages) stays on I/O threads; the CPU-bound
+        # parsing, with the high-water mark check, goes to worker processes
+        with profiling.phase('parse'):
+            marks = load_state().get('feeds', {})
+            feeds = fetch_and_parse(urls, fetch_url_content, {url: marks.get(url) for url in urls})
+        print(f"Parsed {len(feeds)} of {len(urls)} feeds.")
+
+        with profiling.phase('plan'):
+            progress = load_progress()
+            seen = {entry['url'] for entry in progress}
+            remaining_by_host = {}
+            for url, (media, _) in feeds.items():
+                host_dir = os.path.join(OUTPUT_DIR, urlparse(url).netloc)
+                for item in media:
+                    if item['url'] not in seen:
+                        seen.add(item['url'])
+                        remaining_by_host.setdefault(host_dir, []).append(item)
+
+        if remaining_by_host:
+            for host_dir, remaining_media in remaining_by_host.items():
+                progress.extend(download_media(remaining_media, host_dir))
+            save_progress(progress)  # Save progress after download completion
+        else:
+            print("All media files have already been downloaded.")
+
+        # Move each feed's mark only now, keeping what failed for the next poll
+        done_urls = {entry['url'] for entry in progress}
+        state = load_state()
+        for url, (media, mark) in feeds.items():
+            commit_mark(state, url, mark, [item for item in media if item['url'] not in done_urls])
+        save_state(state)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+def plan_job(urls, table=None):
+    """Print what downloading `urls` would involve, without downloading any media.
+
+    Parses the feeds as a run would (without moving their high-water
+    marks), checks the progress file and the files on disk, probes the
+    remaining URLs (caching the results for the real run), and estimates the
+    duration from the per-host throughput recorded by earlier downloads.
+    """
+    counts = Counter()
+    on_disk_bytes = 0
+    to_fetch = []
+    done_urls = {entry['url'] for entry in load_progress()}
+    seen = set()  # Feeds sharing enclosures only download them once
+    for url in urls:
+        try:
+            media, host_dir, _ = fetch_new_media(url, table=table)  # The mark is never committed
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            continue
+        remaining_media = [item for item in media if item['url'] not in done_urls]
+        new_media = [item for item in remaining_media if item['url'] not in seen]
+        seen.update(item['url'] for item in new_media)
+        plan = plan_media(new_media, host_dir, probe=True)
+        counts['downloaded'] += len(media) - len(remaining_media)
+        counts['duplicate'] += len(remaining_media) - len(plan)
+        for entry in plan:
+            if entry.on_disk():
+                counts['on disk'] += 1
+                on_disk_bytes += entry.size
+            else:
+                counts['to fetch'] += 1
+                to_fetch.append(entry)
+
+    limiter.refresh()  # Bandwidth caps from bandwidth.json bound the estimate
+    print(plan_report(counts, on_disk_bytes, to_fetch, load_state(), MAX_THREADS,
+                      limiter.global_bucket.rate, limiter.host_rate))
+
+def record_queue_progress(queue, present=()):
+    """Add the items `queue` holds as done, and the plan entries `present` on disk, to the progress file.
+
+    Normal runs and later coordinator polls then skip them like any other
+    download, and their reserved names are released.
+    """
+    def merge(items):
+        progress = load_progress()
+        done_urls = {entry['url'] for entry in progress}
+        new = [item for item in items + [entry.as_item() for entry in present] if item['url'] not in done_urls]
+        if new:
+            save_progress(progress + new)
+            state = load_state()
+            forget_names(state, [item['url'] for item in new])
+            save_state(state)
+
+    queue.merge_done(merge)
+
+def coordinate(urls, queue_path, table=None):
+    """Publish the download plan for `urls` into a shared queue for --worker processes to drain."""
+    from workqueue import WorkQueue
+
+    queue = WorkQueue(queue_path)
+    record_queue_progress(queue)  # Whatever earlier workers finished, even if none of them exited cleanly
+    for url in urls:
+        try:
+            progress, remaining_media, host_dir, mark = collect_new_media(url, table)
+            # Items published before are retried by the queue; planning them again would only re-probe them
+            queued = queue.urls()
+            new_media = [item for item in remaining_media if item['url'] not in queued]
+            present = []
+            plan = []
+            for entry in plan_media(new_media, host_dir, PROBE_BEFORE_DOWNLOAD):
+                (present if entry.on_disk() else plan).append(entry)
+            added = queue.publish(plan)  # Each entry keeps its reserved name until a worker records it done
+            record_queue_progress(queue, present)
+            state = load_state()
+            commit_mark(state, url, mark, [])  # Published items are retried by the queue, not the feed
+            save_state(state)
+            print(f"Published {added} new items from {url} to {queue_path}.")
+        except Exception as e:
+            print(f"An error occurred: {e}")
+    print(f"Queue: {queue.counts()}")
+
+def work(queue_path, lease_timeout=None):
+    """Claim, download, verify and ack items from a queue published by coordinate()."""
+    from workqueue import WorkQueue, run_worker
+
+    def download(item, file_name):
+        os.makedirs(os.path.dirname(file_name) or '.', exist_ok=True)
+        success, entry = download_media_item(PlannedItem.from_item(item, file_name))
+        if success:
+            sync_pending()  # Durable before the ack, since nobody will retry an acked item
+        return success
+
+    queue = WorkQueue(queue_path, lease_timeout)
+    run_worker(queue, download, MAX_THREADS)
+    record_queue_progress(queue)  # So normal runs don't download the queue's items again
+
 if __name__ == "__main__":
-    url = input("Enter URL to scrape (XML feed): ").strip()
-    main(url)
+    profiling.enable_from_env()
+    parser = argparse.ArgumentParser(description="Download the media enclosures of RSS/Atom feeds.")
+    parser.add_argument('urls', nargs='*', help="Feed URLs (prompted for when omitted)")
+    parser.add_argument('--coordinator', metavar='QUEUE',
+                        help="Publish the download plan to this SQLite queue file instead of downloading")
+    parser.add_argument('--worker', metavar='QUEUE',
+                        help="Download items from a queue file published with --coordinator")
+    parser.add_argument('--lease-timeout', type=float, metavar='SECONDS',
+                        help="With --worker: seconds before a dead worker's items go back to the queue (default 120)")
+    parser.add_argument('--plan', action='store_true',
+                        help="Print item counts, bytes, per-host split and estimated time without downloading")
+    parser.add_argument('--table', action='store_true',
+                        help="The URLs are HTML pages with a table of media links (the a.py/b.py layout by default)")
+    parser.add_argument('--table-config', metavar='JSON',
+                        help="Selectors and column mapping for --table (implies --table); see tablescrape.py")
+    args = parser.parse_args()
+
+    table = None
+    if args.table or args.table_config:
+        from tablescrape import load_config
+        table = load_config(args.table_config)
+
+    if args.worker:
+        work(args.worker, args.lease_timeout)
+    else:
+        urls = args.urls or input("Enter URL to scrape (XML feed, or several separated by spaces): ").split()
+        if args.plan:
+            plan_job(urls, table)
+        elif args.coordinator:
+            coordinate(urls, args.coordinator, table)
+        elif len(urls) > 1 and table is None:
+            main_many(urls)
+        else:
+            for url in urls:
+                main(url, table)
@@ -1,113 +1,70 @@
 import os
 import requests
-import xml.etree.ElementTree as ET
 from urllib.parse import urlparse
-import re
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 import json
-import tkinter as tk
-from tkinter import messagebox
+import profiling
+from planner import DONE, FAILED, run_plan
+from engine import HEADERS, download_media_item, plan_media, settle_downloads
+from diskwriter import remove_stale_parts
+from feedsync import feed_accept_encoding, iter_feed_items
 from threading import Thread
-import tkinter as tk
-from tkinter import ttk  # Import ttk for Progressbar
+
+# tkinter is imported by the GUI functions only, so the download engine can be
+# imported (e.g. by bench.py) without loading Tk
 
 # Constants
 OUTPUT_DIR = "./media"
 LOG_FILE = "./log.txt"
-MAX_RETRIES = 3
 MAX_THREADS = 4  # Optimal number of simultaneous downloads
+QUEUED_PER_THREAD = 4  # Plan entries submitted ahead of each thread; bounds in-flight futures on huge plans
+PROBE_BEFORE_DOWNLOAD = True  # Collect sizes/range support up front (cached in the state file)
 DOWNLOAD_PROGRESS_FILE = "download_progress.json"
 
-# Custom headers to bypass server restrictions
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-}
-
-# Function to sanitize file names by removing or replacing invalid characters
-def sanitize_filename(filename):
-    return re.sub(r'[\\/*?:"<>|]', '_', filename)
+# Feeds and index pages compress 5-10x; prefer zstd and br over gzip when their decoders are installed
+FEED_HEADERS = {**HEADERS, 'Accept-Encoding': feed_accept_encoding()}
 
-def fetch_url_content(url):
-    """Fetch content from a URL with custom headers."""
+def fetch_url_content(url, session=None):
+    """Fetch content from a URL with custom headers, reusing `session`'s connections if given."""
     print(f"Fetching XML from: {url}")
-    response = requests.get(url, headers=HEADERS)
-    response.raise_for_status()
-    return response.content
+    with profiling.phase('fetch'):
+        response = (session or requests).get(url, headers=FEED_HEADERS)
+        response.raise_for_status()
+        return response.content
 
 def parse_xml(content):
     """Extract media links and metadata from XML."""
     print("Parsing XML content...")
-    tree = ET.fromstring(content)
-    items = []
-    for item in tree.findall('channel/item'):
-        title = item.findtext('title', '').strip()
-        enclosure = item.find('enclosure')
-        if enclosure is not None:
-            url = enclosure.get('url', '').strip()
-            if url:
-                items.append({
-                    'url': url,
-                    'title': title,
-                })
+    with profiling.phase('parse'):
+        # Handles RSS enclosures, Atom enclosure links and media:content
+        items = [item for item, _, _ in iter_feed_items(content) if item is not None]
     print(f"Found {len(items)} media files.")
     return items
 
-def download_media_item(item, output_dir, retries=0):
-    """Download a media file and save it to the specified directory."""
-    url = item['url']
-    title = item['title']
-    sanitized_title = sanitize_filename(title)  # Sanitize the title to avoid invalid characters in the filename
-    
-    # Ensure the file path is safe for Windows
-    file_name = os.path.join(output_dir, f"{sanitized_title}.mp3" if '.mp3' in url else os.path.basename(url))
-    
-    print(f"Downloading: {title}\nURL: {url}\nSaving to: {file_name}")
-    
-    attempt = 0
-    success = False
-    
-    # Retry mechanism
-    while attempt < MAX_RETRIES and not success:
-        try:
-            response = requests.get(url, stream=True, headers=HEADERS)
-            response.raise_for_status()
-            
-            with open(file_name, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:  # Filter out keep-alive chunks
-                        f.write(chunk)
-            print(f"Download successful: {file_name}")
-            success = True
-        except requests.exceptions.RequestException as e:
-            attempt += 1
-            print(f"Error downloading {url}: {e}. Attempt {attempt}/{MAX_RETRIES}")
-            time.sleep(2 ** attempt)  # Exponential backoff
-        except Exception as e:
-            print(f"General error: {e}")
-            break
-    
-    return success, item
-
 def download_media(media, output_dir, max_threads, progress_var):
-    """Download media files using parallel threads with progress tracking."""
+    """Download media files using parallel threads with progress tracking; returns the items that succeeded."""
     os.makedirs(output_dir, exist_ok=True)
-    total_files = len(media)
+    remove_stale_parts(output_dir)
+    plan = plan_media(media, output_dir, PROBE_BEFORE_DOWNLOAD)
+    total_files = len(plan)
+    status = bytearray(total_files)  # One byte per entry instead of a Future->item map
     
     # Initialize progress tracking
     downloaded = 0
     
     with ThreadPoolExecutor(max_workers=max_threads) as executor:
-        futures = {executor.submit(download_media_item, item, output_dir): item for item in media}
-        
-        for future in as_completed(futures):
-            item = futures[future]
-            success, item = future.result()
+        for index, (success, entry) in run_plan(executor, download_media_item, plan,
+                                                max_threads * QUEUED_PER_THREAD):
+            status[index] = DONE if success else FAILED
             if success:
                 downloaded += 1
             progress_var.set(downloaded / total_files * 100)
             time.sleep(0.1)  # Small delay to prevent UI from freezing
+    
+    downloaded = [entry for entry, code in zip(plan, status) if code == DONE]
+    settle_downloads(downloaded)
+    return [entry.as_item() for entry in downloaded]
 
 def save_progress(media, filename=DOWNLOAD_PROGRESS_FILE):
     """Save download progress to a file."""
@@ -124,6 +81,8 @@ def load_progress(filename=DOWNLOAD_PROGRESS_FILE):
 
 def start_download_thread(url, output_dir, max_threads, progress_var):
     """Start the download process in a separate thread."""
+    from tkinter import messagebox
+
     def download_thread():
         try:
             content = fetch_url_content(url)
@@ -134,12 +93,14 @@ def start_download_thread(url, output_dir, max_threads, progress_var):
             host_dir = os.path.join(output_dir, parsed_url.netloc)
 
             # Load previous progress (if available) and resume from where we left off
-            progress = load_progress()
-            remaining_media = [item for item in media if item not in progress]
+            with profiling.phase('plan'):
+                progress = load_progress()
+                done_urls = {entry['url'] for entry in progress}
+                remaining_media = [item for item in media if item['url'] not in done_urls]
             
             if remaining_media:
-                download_media(remaining_media, host_dir, max_threads, progress_var)
-                save_progress(media)  # Save progress after download completion
+                downloaded = download_media(remaining_media, host_dir, max_threads, progress_var)
+                save_progress(progress + downloaded)  # Save progress after download completion
             else:
                 print("All media files have already been downloaded.")
                 messagebox.showinfo("Download Complete", "All files have already been downloaded.")
@@ -159,6 +120,10 @@ def stop_download():
 
 # GUI Setup
 def create_gui():
+    import tkinter as tk
+    from tkinter import messagebox
+    from tkinter import ttk  # Import ttk for Progressbar
+
     root = tk.Tk()
     root.title("Media Downloader")
 
@@ -194,4 +159,5 @@ def create_gui():
     root.mainloop()
 
 if __name__ == "__main__":
+    profiling.enable_from_env()
     create_gui()
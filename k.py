@@ -28,8 +28,9 @@ def download_file(url, output_path, progress_var):
                 if chunk:
                     file.write(chunk)
                     downloaded_size += len(chunk)
-                    progress = (downloaded_size / total_size) * 100
-                    progress_var.set(progress)
+                    if total_size:  # Servers may omit Content-Length
+                        progress = (downloaded_size / total_size) * 100
+                        progress_var.set(progress)
     except requests.exceptions.RequestException as e:
         print(f"Error downloading {url}: {e}")
 
@@ -0,0 +1,117 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from diskwriter import create_staging_file, schedule_sync
+
+# Constants
+HEDGE_AFTER = 5.0  # Seconds to let a source run before judging its throughput
+MIN_THROUGHPUT = 256 * 1024  # Bytes/s below which we also start the next mirror
+CHECK_INTERVAL = 0.5
+
+# Hosts known to mirror each other's enclosures, e.g. {'media.example.com': ['mirror.example.net']}
+KNOWN_MIRRORS = {}
+
+def mirror_urls(entry):
+    """Return a plan entry's primary URL followed by its alternates and known-host mirrors."""
+    url = entry.url
+    urls = [url, *(entry.mirrors or ())]
+    parsed = urlparse(url)
+    for host in KNOWN_MIRRORS.get(parsed.netloc, []):
+        urls.append(parsed._replace(netloc=host).geturl())
+    return list(dict.fromkeys(urls))
+
+class Transfer:
+    """One source racing for a file; `fetch` updates `bytes`, stores its `response` and stops when `cancelled` is set."""
+
+    def __init__(self, url, part_name):
+        self.url = url
+        self.part_name = part_name
+        self.bytes = 0
+        self.error = None
+        self.response = None
+        self.started = time.monotonic()
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        """Stop this source, shutting down its socket so a read stalled on it returns now."""
+        self.cancelled.set()
+        response = self.response
+        # urllib3 2.3+; closing instead would wait for the fetch thread's read. Without it the read timeout applies.
+        shutdown = getattr(getattr(response, 'raw', None), 'shutdown', None)
+        if shutdown is not None:
+            try:
+                shutdown()
+            except (OSError, RuntimeError, ValueError):
+                pass  # Already finished or released to the pool
+
+    def throughput(self):
+        elapsed = time.monotonic() - self.started
+        return self.bytes / elapsed if elapsed else 0.0
+
+def _run(transfer, fetch, finished):
+    try:
+        fetch(transfer.url, transfer.part_name, transfer)
+    except Exception as e:
+        transfer.error = e
+    if transfer.cancelled.is_set() or transfer.error is not None:
+        try:
+            os.remove(transfer.part_name)
+        except OSError:
+            pass
+    finished.put(transfer)
+
+def race_download(urls, file_name, fetch, hedge_after=HEDGE_AFTER, min_throughput=MIN_THROUGHPUT):
+    """Download `file_name` from the first of `urls` to finish, hedging onto mirrors.
+
+    Starts on the primary. Whenever every running source has had
+    `hedge_after` seconds and still moves less than `min_throughput` bytes/s,
+    or a source fails, the next mirror is started alongside. The first
+    source to complete is renamed into place and the others are cancelled.
+    `fetch(url, path, transfer)` does the actual copy; it should set
+    `transfer.response` so a cancelled source can be stopped mid-read, and
+    use a read timeout so a stalled one can't hang forever. Returns the
+    winning URL; if every source fails, the last error is raised.
+    """
+    finished = queue.Queue()
+    remaining = deque(urls)
+    active = []
+    last_error = None
+    last_start = 0.0
+
+    def start_next():
+        nonlocal last_start
+        url = remaining.popleft()
+        fd, part_name = create_staging_file(file_name)  # Hidden, so a killed race leaves nothing the planner sees
+        os.close(fd)
+        transfer = Transfer(url, part_name)
+        active.append(transfer)
+        last_start = time.monotonic()
+        threading.Thread(target=_run, args=(transfer, fetch, finished), daemon=True).start()
+
+    start_next()
+    while active:
+        try:
+            transfer = finished.get(timeout=CHECK_INTERVAL)
+        except queue.Empty:
+            slow = all(t.throughput() < min_throughput for t in active)
+            if remaining and slow and time.monotonic() - last_start >= hedge_after:
+                print(f"Slow transfer for {file_name}, trying mirror {remaining[0]}")
+                start_next()
+            continue
+
+        active.remove(transfer)
+        if transfer.error is None:
+            for loser in active:
+                loser.cancel()  # Losers delete their own part files
+            os.replace(transfer.part_name, file_name)
+            schedule_sync(file_name)
+            return transfer.url
+        last_error = transfer.error
+        print(f"Source failed for {file_name}: {transfer.url}: {transfer.error}")
+        if remaining:
+            start_next()
+    raise last_error
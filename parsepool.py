@@ -0,0 +1,129 @@
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, ProcessPoolExecutor, wait
+
+from feedsync import ARCHIVE_THREADS, FeedScan, PageQueue
+
+# Constants
+MAX_FETCH_THREADS = 8  # Network concurrency for fetching feeds and index pages
+MEDIA_EXTENSIONS = ('.mp3', '.mp4', '.avi', '.mkv')
+XML_MARKERS = (b'<?xml', b'<rss', b'<feed')
+UTF8_BOM = b'\xef\xbb\xbf'
+
+def parse_feed_page(content, page_url, scan):
+    """Read one page of an RSS or Atom feed for `scan`; returns (scan, records, further page URLs).
+
+    Records are (url, title, mime_type, mirrors) tuples of the items new
+    since the feed's high-water mark. The page links are returned rather
+    than fetched, so workers never touch the network.
+    """
+    links = []
+    items = scan.read_page(content, page_url, links.append)
+    records = [(item['url'], item['title'], item['type'], tuple(item.get('mirrors', ()))) for item in items]
+    return scan, records, links
+
+def parse_html_bytes(content):
+    """Extract (url, title, mime_type, mirrors) records for media links in an HTML page."""
+    # Imported here so XML-only runs don't need BeautifulSoup installed
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    # Only build nodes for anchors instead of the whole DOM
+    soup = BeautifulSoup(content, 'html.parser', parse_only=SoupStrainer('a', href=True))
+    records = []
+    for link in soup.find_all('a', href=True):
+        href = link['href']
+        if href.endswith(MEDIA_EXTENSIONS):
+            records.append((href, link.text.strip() or os.path.basename(href), '', ()))
+    return records
+
+def parse_document(content, url, scan):
+    """Parse a feed's first page or an HTML page into (scan, records, further page URLs), sniffing XML vs HTML."""
+    if content[:64].removeprefix(UTF8_BOM).lstrip().startswith(XML_MARKERS):
+        return parse_feed_page(content, url, scan)
+    return None, parse_html_bytes(content), []  # HTML pages have no mark and no further pages
+
+def fetch_and_parse(urls, fetch, marks=None, max_threads=MAX_FETCH_THREADS, max_workers=None):
+    """Fetch `urls` and their further feed pages on threads and parse them in a process pool as they arrive.
+
+    Each page's raw bytes go to a worker together with its feed's FeedScan
+    (built from the high-water mark in `marks`), and the scan comes back
+    with compact (url, title, mime_type, mirrors) tuples and the links of
+    further pages, so no parse trees are pickled. Those pages are fetched
+    here, ARCHIVE_THREADS per feed ahead of the parser. A feed's pages are
+    parsed in order, different feeds in parallel. Returns
+    {url: (items, new mark)} with the same item dicts as sync_feed; feeds
+    whose first page fails to fetch or parse are reported and left out.
+    """
+    marks = marks or {}
+    feeds = {}  # Feed URL -> [scan, pages, records]
+    fetching = {}  # Future of the page each feed reads next -> (feed URL, page URL)
+    parsing = {}  # Parse future -> (feed URL, page URL)
+    results = {}
+
+    def finish(url):
+        scan, pages, records = feeds.pop(url)
+        pages.close()
+        items = []
+        for media_url, title, mime_type, mirrors in records:
+            item = {'url': media_url, 'title': title, 'type': mime_type}
+            if mirrors:
+                item['mirrors'] = list(mirrors)
+            items.append(item)
+        results[url] = scan.finish(items) if scan is not None else (items, None)
+
+    def next_page(url):
+        scan, pages, _ = feeds[url]
+        if pages and not (scan is not None and scan.stopped):
+            page_url, future = pages.take()
+            fetching[future] = (url, page_url)
+        else:
+            finish(url)
+
+    def page_failed(url, page_url, action, error):
+        print(f"Error {action} {page_url}: {error}")
+        if page_url == url:
+            feeds.pop(url)[1].close()
+        else:
+            feeds[url][0].complete = False  # Keep what the earlier pages found
+            finish(url)
+
+    # spawn rather than fork: forking while fetch threads hold locks can deadlock the children
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as cpu_pool, \
+            ThreadPoolExecutor(max_workers=max_threads) as io_pool:
+        for url in urls:
+            pages = PageQueue(io_pool, fetch, ARCHIVE_THREADS)
+            pages.add(url)
+            feeds[url] = [FeedScan(url, marks.get(url)), pages, []]
+            next_page(url)
+
+        while fetching or parsing:
+            done, _ = wait([*fetching, *parsing], return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in fetching:
+                    url, page_url = fetching.pop(future)
+                    try:
+                        content = future.result()
+                    except Exception as e:
+                        page_failed(url, page_url, "fetching", e)
+                        continue
+                    scan = feeds[url][0]
+                    if page_url == url:
+                        parse = cpu_pool.submit(parse_document, content, page_url, scan)
+                    else:
+                        parse = cpu_pool.submit(parse_feed_page, content, page_url, scan)
+                    parsing[parse] = (url, page_url)
+                else:
+                    url, page_url = parsing.pop(future)
+                    try:
+                        scan, records, links = future.result()
+                    except Exception as e:
+                        page_failed(url, page_url, "parsing", e)
+                        continue
+                    feed = feeds[url]
+                    feed[0] = scan
+                    feed[2] += records
+                    for link in links:
+                        feed[1].add(link)
+                    next_page(url)
+    return results
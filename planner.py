@@ -0,0 +1,191 @@
+import itertools
+import os
+import posixpath
+import re
+import sys
+from concurrent.futures import FIRST_COMPLETED, wait
+from urllib.parse import urlparse, unquote
+
+# Characters that are invalid in Windows file names, plus control characters
+INVALID_CHARS_RE = re.compile(r'[\\/*?:"<>|\x00-\x1f]')
+MAX_NAME_LENGTH = 180  # Leaves room for the directory, suffix and extension under MAX_PATH
+DEFAULT_EXTENSION = '.mp3'
+
+# Values of the per-entry status column (a bytearray) kept by the engines while a plan runs
+PENDING, DONE, FAILED = 0, 1, 2
+
+MEDIA_EXTENSIONS = {
+    '.mp3', '.m4a', '.aac', '.ogg', '.oga', '.opus', '.wav', '.flac',
+    '.mp4', '.m4v', '.mov', '.webm', '.avi', '.mkv', '.pdf',
+}
+
+MIME_EXTENSIONS = {
+    'audio/mpeg': '.mp3',
+    'audio/mp3': '.mp3',
+    'audio/x-mpeg': '.mp3',
+    'audio/mp4': '.m4a',
+    'audio/x-m4a': '.m4a',
+    'audio/aac': '.aac',
+    'audio/ogg': '.ogg',
+    'audio/opus': '.opus',
+    'audio/wav': '.wav',
+    'audio/x-wav': '.wav',
+    'audio/flac': '.flac',
+    'video/mp4': '.mp4',
+    'video/x-m4v': '.m4v',
+    'video/quicktime': '.mov',
+    'video/webm': '.webm',
+    'video/x-msvideo': '.avi',
+    'video/x-matroska': '.mkv',
+    'application/pdf': '.pdf',
+}
+
+class PlannedItem:
+    """One entry of a download plan: the feed item's fields plus where it is saved.
+
+    Plans for archive backfills run to 100k items, so entries use __slots__
+    instead of a dict per item, keep only the file's base name next to a
+    directory string shared by the whole plan, and intern the few distinct
+    MIME types. `size` is filled in from the probe when one was made.
+    """
+
+    __slots__ = ('url', 'title', 'type', 'mirrors', 'directory', 'name', 'size')
+
+    def __init__(self, url, title, type='', mirrors=None, directory='', name='', size=None):
+        self.url = url
+        self.title = title
+        self.type = sys.intern(type or '')
+        self.mirrors = tuple(mirrors) if mirrors else None
+        self.directory = directory
+        self.name = name
+        self.size = size
+
+    @classmethod
+    def from_item(cls, item, file_name):
+        """Rebuild an entry from a feed item dict and its full target path."""
+        directory, name = os.path.split(file_name)
+        return cls(item['url'], item.get('title', ''), item.get('type'), item.get('mirrors'), directory, name)
+
+    @property
+    def file_name(self):
+        return os.path.join(self.directory, self.name)
+
+    def on_disk(self):
+        """True if the target already holds a file of the probed size, e.g. from a run that never saved progress."""
+        if self.size is None:
+            return False
+        try:
+            return os.path.getsize(self.file_name) == self.size
+        except OSError:
+            return False
+
+    def as_item(self):
+        """Return the feed item dict, as stored in the progress file and the work queue."""
+        item = {'url': self.url, 'title': self.title, 'type': self.type}
+        if self.mirrors:
+            item['mirrors'] = list(self.mirrors)
+        return item
+
+def sanitize_filename(filename):
+    """Replace characters that are invalid in file names and trim what Windows rejects."""
+    name = INVALID_CHARS_RE.sub('_', filename).strip().rstrip('. ')
+    return name[:MAX_NAME_LENGTH].rstrip('. ')
+
+def media_extension(url, mime_type=None):
+    """Pick a file extension from the URL path (ignoring any query string), then the MIME type."""
+    extension = posixpath.splitext(urlparse(url).path)[1].lower()
+    if extension in MEDIA_EXTENSIONS:
+        return extension
+    if mime_type:
+        mime_extension = MIME_EXTENSIONS.get(mime_type.split(';')[0].strip().lower())
+        if mime_extension:
+            return mime_extension
+    return DEFAULT_EXTENSION
+
+def target_name(item):
+    """Build the base file name (without collision suffix) for an item."""
+    url = item['url']
+    stem = sanitize_filename(item.get('title', ''))
+    if not stem:
+        stem = sanitize_filename(posixpath.splitext(unquote(posixpath.basename(urlparse(url).path)))[0])
+    return stem or 'untitled', media_extension(url, item.get('type'))
+
+def existing_names(directory):
+    """Case-folded names of the files already in `directory` (staging files excluded)."""
+    if not os.path.isdir(directory):
+        return set()
+    return {entry.name.casefold() for entry in os.scandir(directory) if not entry.name.startswith('.')}
+
+def plan_downloads(media, output_dir, assigned=None):
+    """Compute every target path up front in one pass.
+
+    Returns a list of PlannedItem entries. Items repeating an earlier URL
+    are dropped so they are never fetched twice. `assigned` maps URLs to the
+    names earlier plans gave them in `output_dir`; those are reused as is.
+    Other items never take a name that is assigned or already on disk, so
+    an item from an earlier run is never overwritten; distinct items that
+    map to the same name get " (2)", " (3)", ... suffixes in feed order.
+    Names are compared case-insensitively so the plan is also collision-free
+    on Windows and macOS file systems.
+    """
+    assigned = assigned or {}
+    plan = []
+    seen_urls = set()
+    taken = existing_names(output_dir)
+    taken.update(name.casefold() for name in assigned.values())
+    duplicates = 0
+    for item in media:
+        url = item['url']
+        if url in seen_urls:
+            duplicates += 1
+            continue
+        seen_urls.add(url)
+
+        name = assigned.get(url)
+        if name is None:
+            stem, extension = target_name(item)
+            name = stem + extension
+            counter = 1
+            while name.casefold() in taken:
+                counter += 1
+                name = f"{stem} ({counter}){extension}"
+            taken.add(name.casefold())
+        plan.append(PlannedItem(url, item.get('title', ''), item.get('type'), item.get('mirrors'), output_dir, name))
+
+    if duplicates:
+        print(f"Skipped {duplicates} duplicate media URLs.")
+    return plan
+
+def assigned_names(state, output_dir):
+    """Return {url: name} of the names reserved in `state` for items still to download into `output_dir`."""
+    return {url: os.path.basename(path) for url, path in state.get('names', {}).items()
+            if os.path.dirname(path) == output_dir}
+
+def remember_names(state, plan):
+    """Reserve the plan's names in `state` until the items are downloaded, so later plans reuse them."""
+    names = state.setdefault('names', {})
+    for entry in plan:
+        names[entry.url] = entry.file_name
+
+def forget_names(state, urls):
+    """Release the reservations of downloaded items; their files on disk now hold the names."""
+    names = state.get('names', {})
+    for url in urls:
+        names.pop(url, None)
+
+def run_plan(executor, download, plan, window):
+    """Run `download(entry)` for every plan entry, yielding (index, result) as each one finishes.
+
+    Only `window` entries are handed to `executor` ahead of time and the next
+    one is submitted as each finishes, so a 100k-item plan never holds 100k
+    Future objects and their locks at once.
+    """
+    entries = enumerate(plan)
+    in_flight = {executor.submit(download, entry): index for index, entry in itertools.islice(entries, window)}
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = in_flight.pop(future)
+            for next_index, entry in itertools.islice(entries, 1):
+                in_flight[executor.submit(download, entry)] = next_index
+            yield index, future.result()
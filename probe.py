@@ -0,0 +1,99 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Constants
+PROBE_THREADS = 16  # Probes are tiny, so they can run wider than the download pool
+PROBE_TTL = 24 * 3600  # Seconds before a cached probe is considered stale
+PROBE_TIMEOUT = 15
+
+CONTENT_RANGE_RE = re.compile(r'bytes \d+-\d+/(\d+)')
+
+def make_session(headers, pool_size=PROBE_THREADS):
+    """Create a session whose connection pool is large enough to keep every probe thread's connection alive."""
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def parse_length(value):
+    """Return a Content-Length header as an int, or None if it is missing or malformed."""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return None
+    return size if size >= 0 else None
+
+def probe_url(session, url):
+    """Collect size, range support, ETag and type for one URL.
+
+    Tries HEAD first and falls back to a `Range: bytes=0-0` GET for servers
+    that reject HEAD or leave out Content-Length on it.
+    """
+    response = session.head(url, allow_redirects=True, timeout=PROBE_TIMEOUT)
+    size = parse_length(response.headers.get('Content-Length')) if response.ok else None
+    if size is None:
+        response = session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=PROBE_TIMEOUT)
+        response.close()  # Never read the body; a server ignoring Range would send the whole file
+        response.raise_for_status()
+        match = CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+        if match:
+            size = int(match.group(1))
+        elif response.status_code == 200:
+            size = parse_length(response.headers.get('Content-Length'))
+
+    return {
+        'size': size,
+        'ranges': response.headers.get('Accept-Ranges', '').lower() == 'bytes' or response.status_code == 206,
+        'etag': response.headers.get('ETag'),
+        'type': response.headers.get('Content-Type'),
+        'checked': time.time(),
+    }
+
+def probe_all(urls, state, headers, max_threads=PROBE_THREADS, ttl=PROBE_TTL):
+    """Probe every URL concurrently over pooled connections, reusing fresh results cached in `state`.
+
+    Returns {url: probe} for every URL that has a cached or new probe; failed
+    probes are reported and left out so they are retried next run. Cached
+    probes older than `ttl` are dropped from `state`, so the cache doesn't
+    grow with every URL ever seen.
+    """
+    cache = state.setdefault('probes', {})
+    now = time.time()
+    for url in [url for url, cached in cache.items() if now - cached['checked'] >= ttl]:
+        del cache[url]
+    results = {}
+    stale = []
+    for url in dict.fromkeys(urls):
+        cached = cache.get(url)
+        if cached and now - cached['checked'] < ttl:
+            results[url] = cached
+        else:
+            stale.append(url)
+
+    if stale:
+        print(f"Probing {len(stale)} URLs ({len(results)} cached)...")
+        with make_session(headers, max_threads) as session, ThreadPoolExecutor(max_workers=max_threads) as executor:
+            futures = {executor.submit(probe_url, session, url): url for url in stale}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    results[url] = cache[url] = future.result()
+                except requests.exceptions.RequestException as e:
+                    print(f"Error probing {url}: {e}")
+    return results
+
+def forget_probes(state, urls):
+    """Drop the cached probes of URLs that have been downloaded and won't be probed again."""
+    cache = state.get('probes', {})
+    for url in urls:
+        cache.pop(url, None)
+
+def order_by_size(plan, probes):
+    """Order a download plan largest first so the pool doesn't end on one long transfer; unknown sizes go last."""
+    return sorted(plan, key=lambda entry: -(probes.get(entry.url, {}).get('size') or 0))
@@ -0,0 +1,157 @@
+import atexit
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Opt-in profiling: set DOWNLOADER_PROFILE to a report path to enable it.
+# DOWNLOADER_PROFILE_MODE picks what runs next to the phase timers:
+#   timers   - per-phase wall/CPU timers only (default)
+#   cprofile - cProfile of every thread (downloads and writes run in pools), merged into <report>.prof
+#   sample   - stack sampler over all threads, folded stacks in <report>.folded
+PROFILE_ENV = "DOWNLOADER_PROFILE"
+PROFILE_MODE_ENV = "DOWNLOADER_PROFILE_MODE"
+SAMPLE_INTERVAL = 0.005  # Seconds between stack samples
+
+# Phase names used by the engines: fetch, parse, plan, download, write, verify.
+# 'write' and 'verify' are nested inside 'download', so download minus those is time spent on the network.
+_NULL_PHASE = contextlib.nullcontext()
+_state = None
+
+class _Phase:
+    """Context manager that adds its wall and thread CPU time to a phase total."""
+    __slots__ = ('name', 'state', 'wall', 'cpu')
+
+    def __init__(self, name, state):
+        self.name = name
+        self.state = state
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        with self.state['lock']:
+            totals = self.state['phases'].setdefault(self.name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] += cpu
+        return False
+
+def phase(name):
+    """Time a pipeline phase; a no-op unless profiling is enabled."""
+    if _state is None:
+        return _NULL_PHASE
+    return _Phase(name, _state)
+
+def _sample_stacks(stop, samples):
+    """Record the collapsed stack of every other thread until `stop` is set."""
+    me = threading.get_ident()
+    while not stop.wait(SAMPLE_INTERVAL):
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            samples[';'.join(reversed(stack))] += 1
+
+def _profile_new_thread(frame, event, arg):
+    """threading.setprofile hook: give each new thread its own profiler, which then replaces this hook."""
+    import cProfile
+
+    state = _state
+    if state is None:
+        return
+    profiler = cProfile.Profile()
+    with state['lock']:
+        state['profilers'].append(profiler)
+    profiler.enable()
+
+def enable(output, mode='timers'):
+    """Start collecting phase timers (and a profiler, per `mode`) until the report is written."""
+    global _state
+    if _state is not None:
+        return
+    if mode not in ('timers', 'cprofile', 'sample'):
+        raise ValueError(f"Unknown profiling mode: {mode}")
+    _state = {
+        'output': output,
+        'mode': mode,
+        'lock': threading.Lock(),
+        'phases': {},
+        'wall': time.perf_counter(),
+        'cpu': time.process_time(),
+    }
+    if mode == 'cprofile':
+        import cProfile
+        _state['profilers'] = []
+        _state['profiler'] = cProfile.Profile()
+        _state['profiler'].enable()
+        # Before 3.12 a profiler only sees the thread that enabled it; from 3.12 on it
+        # sees every thread, and a second enabled profiler would be rejected
+        if sys.version_info < (3, 12):
+            threading.setprofile(_profile_new_thread)
+    elif mode == 'sample':
+        _state['samples'] = Counter()
+        _state['stop'] = threading.Event()
+        _state['sampler'] = threading.Thread(
+            target=_sample_stacks, args=(_state['stop'], _state['samples']), daemon=True)
+        _state['sampler'].start()
+    atexit.register(write_report)
+
+def enable_from_env():
+    """Enable profiling if DOWNLOADER_PROFILE is set."""
+    output = os.environ.get(PROFILE_ENV)
+    if output:
+        enable(output, os.environ.get(PROFILE_MODE_ENV, 'timers'))
+
+def write_report():
+    """Stop profiling and write the report; sorted keys keep reports diffable between releases."""
+    global _state
+    state, _state = _state, None
+    if state is None:
+        return
+    report = {
+        'mode': state['mode'],
+        'total': {
+            'wall_s': round(time.perf_counter() - state['wall'], 4),
+            'cpu_s': round(time.process_time() - state['cpu'], 4),
+        },
+        # Wall and CPU are summed across threads, so phases run in a pool can exceed the total
+        'phases': {
+            name: {'calls': calls, 'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4)}
+            for name, (calls, wall, cpu) in state['phases'].items()
+        },
+    }
+    output = state['output']
+    if state['mode'] == 'cprofile':
+        import pstats
+
+        threading.setprofile(None)
+        state['profiler'].disable()
+        stats = pstats.Stats(state['profiler'])
+        with state['lock']:
+            for profiler in state['profilers']:
+                stats.add(profiler)
+        stats.dump_stats(f"{output}.prof")
+        report['profile'] = f"{output}.prof"
+    elif state['mode'] == 'sample':
+        state['stop'].set()
+        state['sampler'].join()
+        with open(f"{output}.folded", 'w') as f:
+            for stack, count in sorted(state['samples'].items()):
+                f.write(f"{stack} {count}\n")
+        report['profile'] = f"{output}.folded"
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Profile written: {output}")
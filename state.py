@@ -0,0 +1,26 @@
+import json
+import os
+import threading
+
+# Shared on-disk state (probe cache, per-feed sync marks, ...), kept next to download_progress.json
+STATE_FILE = "downloader_state.json"
+
+_lock = threading.Lock()
+
+def load_state(filename=STATE_FILE):
+    """Load the state store, or an empty one if it doesn't exist or is unreadable."""
+    if os.path.exists(filename):
+        try:
+            with open(filename, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable state file {filename}: {e}")
+    return {}
+
+def save_state(state, filename=STATE_FILE):
+    """Write the state store atomically so an interrupted run never leaves it half-written."""
+    temp_name = f"{filename}.tmp"
+    with _lock:
+        with open(temp_name, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_name, filename)
@@ -0,0 +1,169 @@
+import importlib.util
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+from feedsync import PageQueue, close_source, numbered_pages
+
+# Constants
+PAGE_THREADS = 8  # Concurrent page fetches once the page range is known
+MAX_PAGES = 1000
+
+# The layout a.py/b.py hardcode (the zchg.org tape list): one header row, tape
+# number and link in the first cell, title in the third. A JSON config file
+# overrides any of these keys.
+DEFAULT_CONFIG = {
+    # SoupStrainer arguments: only these elements and their contents become nodes.
+    # <link rel="next"> sits in <head>; add 'a' if a site only has pager anchors.
+    'strain': {'name': ['table', 'link']},
+    'table': 'table',  # CSS selector for the tables holding the items
+    'row': 'tr',  # CSS selector for the item rows inside a table
+    'skip_rows': 1,  # Header rows at the top of each table
+    'cell': 'td',
+    'min_cells': 4,  # Rows with fewer cells are skipped as malformed
+    # field -> cell index, optional CSS selector inside the cell, and attribute (default: the text)
+    'columns': {
+        'url': {'cell': 0, 'select': 'a', 'attr': 'href'},
+        'number': {'cell': 0},
+        'title': {'cell': 2},
+    },
+    'title': '{number} - {title}',  # Item title built from the fields, used for the file name
+    'next': 'link[rel~=next], a[rel~=next]',
+    'last': 'link[rel~=last], a[rel~=last]',
+    # Optional page URL template, e.g. "{url}?page={page}", for sites without a last link:
+    # pages are then fetched PAGE_THREADS at a time until one has no rows
+    'page_url': None,
+    'max_pages': MAX_PAGES,
+}
+
+_parser = None
+
+def load_config(filename=None):
+    """Return DEFAULT_CONFIG updated with the keys of a JSON config file, if given."""
+    config = dict(DEFAULT_CONFIG)
+    if filename:
+        with open(filename, "r") as f:
+            config.update(json.load(f))
+    return config
+
+def html_parser():
+    """Prefer lxml's parser when installed; html.parser otherwise."""
+    global _parser
+    if _parser is None:
+        _parser = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+    return _parser
+
+def cell_value(cell, column):
+    """Read one mapped field from a table cell."""
+    if column.get('select'):
+        cell = cell.select_one(column['select'])
+        if cell is None:
+            return None
+    if column.get('attr'):
+        return cell.get(column['attr'])
+    return cell.get_text(strip=True)
+
+def parse_page(content, page_url, config):
+    """Extract (items, {'next': url, 'last': url}) from one page, building nodes only for strained elements.
+
+    `content` is bytes or a stream, which is read (decompressing as it
+    arrives) and closed.
+    """
+    # Imported here so feed-only runs don't need BeautifulSoup installed
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    try:
+        soup = BeautifulSoup(content, html_parser(), parse_only=SoupStrainer(**config['strain']))
+    finally:
+        close_source(content)
+    items = []
+    for table in soup.select(config['table']):
+        for row in table.select(config['row'])[config['skip_rows']:]:
+            cells = row.select(config['cell'])
+            if len(cells) < config['min_cells']:
+                continue  # Skip malformed rows
+            fields = {}
+            for field, column in config['columns'].items():
+                index = column['cell']
+                fields[field] = cell_value(cells[index], column) if index < len(cells) else None
+            if not fields.get('url'):
+                continue
+            fields['url'] = urljoin(page_url, fields['url'].strip())
+            try:
+                title = config['title'].format(**{key: value or '' for key, value in fields.items()})
+            except (KeyError, IndexError) as e:
+                raise ValueError(f"Title template {config['title']!r} uses an unmapped field: {e}")
+            items.append({'url': fields['url'], 'title': title.strip(), 'type': ''})
+
+    links = {}
+    for rel in ('next', 'last'):
+        link = soup.select_one(config[rel]) if config.get(rel) else None
+        if link is not None and link.get('href'):
+            links[rel] = urljoin(page_url, link['href'])
+    return items, links
+
+def read_pages(executor, fetch, page_urls, config, window=PAGE_THREADS):
+    """Fetch `page_urls` up to `window` ahead of parsing and yield each page's items in order ([] for a page that failed)."""
+    pages = PageQueue(executor, fetch, window, limit=len(page_urls))
+    for page_url in page_urls:
+        pages.add(page_url)
+    try:
+        while pages:
+            page_url, future = pages.take()
+            try:
+                yield parse_page(future.result(), page_url, config)[0]
+            except Exception as e:
+                print(f"Error reading page {page_url}: {e}")
+                yield []
+    finally:
+        pages.close()  # Pages left unread when the caller stops early
+
+def scrape_table(url, fetch, config=None, max_threads=PAGE_THREADS):
+    """Return the item dicts from the table pages starting at `url`, in page order.
+
+    `fetch(url)` returns a page's bytes or a stream of them. When the first
+    page links to a numbered last page, every page in between is fetched,
+    `max_threads` pages ahead of the parser; with a `page_url` template pages
+    are fetched `max_threads` at a time until one comes back without rows;
+    otherwise `next` links are followed one by one.
+    Parsing stays on the calling thread while the fetches run.
+    """
+    config = config or DEFAULT_CONFIG
+    max_pages = config.get('max_pages') or MAX_PAGES
+    items, links = parse_page(fetch(url), url, config)
+    pages_read = 1
+
+    with ThreadPoolExecutor(max_workers=max_threads) as executor:
+        pages = numbered_pages(links['next'], links['last']) if 'next' in links and 'last' in links else []
+        if pages:
+            for page_items in read_pages(executor, fetch, pages[:max_pages - 1], config, max_threads):
+                items += page_items
+                pages_read += 1
+        elif config.get('page_url'):
+            number = 2
+            exhausted = False
+            while not exhausted and number <= max_pages:
+                last = min(number + max_threads, max_pages + 1)
+                batch = [config['page_url'].format(url=url, page=n) for n in range(number, last)]
+                for page_items in read_pages(executor, fetch, batch, config, max_threads):
+                    if not page_items:
+                        exhausted = True  # Past the last page; the rest of the batch is ignored
+                        break
+                    items += page_items
+                    pages_read += 1
+                number = last
+        else:
+            seen = {url}
+            while 'next' in links and links['next'] not in seen and pages_read < max_pages:
+                page_url = links['next']
+                seen.add(page_url)
+                try:
+                    page_items, links = parse_page(fetch(page_url), page_url, config)
+                except Exception as e:
+                    print(f"Error reading page {page_url}: {e}")
+                    break
+                items += page_items
+                pages_read += 1
+
+    print(f"Found {len(items)} media files in {pages_read} pages.")
+    return items
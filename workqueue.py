@@ -0,0 +1,212 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+# Constants
+LEASE_TIMEOUT = 120  # Seconds a claimed item stays invisible to other workers without a heartbeat
+HEARTBEAT_INTERVAL = 30  # Seconds between lease renewals; well inside LEASE_TIMEOUT
+MAX_ATTEMPTS = 5  # Claims per item before it is marked failed
+POLL_INTERVAL = 2.0  # Seconds an idle worker waits while other workers still hold leases (less for short leases)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    item TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status, lease_expires);
+"""
+
+def worker_id():
+    """Identify this worker process across machines sharing the queue."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class WorkQueue:
+    """A download plan shared through one SQLite file, claimed by workers under expiring leases.
+
+    Every call opens its own connection, so a queue object can be used from
+    several threads, and any number of processes (on one box or several
+    sharing a mount) can work the same file. The default rollback journal is
+    kept because WAL mode does not work on network file systems.
+    """
+
+    def __init__(self, path, lease_timeout=None):
+        self.path = path
+        self.lease_timeout = lease_timeout or LEASE_TIMEOUT
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return Connection(db)
+
+    def publish(self, plan):
+        """Add planner entries; URLs already in the queue keep their current state."""
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            before = db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+            db.executemany(
+                "INSERT OR IGNORE INTO items (url, item, file_name) VALUES (?, ?, ?)",
+                [(entry.url, json.dumps(entry.as_item()), entry.file_name) for entry in plan],
+            )
+            added = db.execute("SELECT COUNT(*) FROM items").fetchone()[0] - before
+            db.execute("COMMIT")
+        return added
+
+    def claim(self, owner, limit=1):
+        """Lease up to `limit` pending or expired items to `owner`; returns [(id, item, file_name)]."""
+        now = time.time()
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")  # Take the write lock first so two workers can't claim the same rows
+            # Items whose last allowed attempt died with its worker will never be retried
+            db.execute(
+                "UPDATE items SET status = 'failed', error = 'lease expired' WHERE status = 'leased'"
+                " AND lease_expires < ? AND attempts >= ?",
+                (now, MAX_ATTEMPTS),
+            )
+            rows = db.execute(
+                "SELECT id, item, file_name FROM items"
+                " WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?))"
+                " AND attempts < ? ORDER BY id LIMIT ?",
+                (now, MAX_ATTEMPTS, limit),
+            ).fetchall()
+            db.executemany(
+                "UPDATE items SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1"
+                " WHERE id = ?",
+                [(owner, now + self.lease_timeout, row['id']) for row in rows],
+            )
+            db.execute("COMMIT")
+        return [(row['id'], json.loads(row['item']), row['file_name']) for row in rows]
+
+    def heartbeat(self, owner):
+        """Extend every lease `owner` still holds."""
+        with self.connect() as db:
+            db.execute(
+                "UPDATE items SET lease_expires = ? WHERE owner = ? AND status = 'leased'",
+                (time.time() + self.lease_timeout, owner),
+            )
+
+    def ack(self, owner, item_id):
+        """Mark an item done; ignored if the lease was lost to another worker meanwhile."""
+        with self.connect() as db:
+            db.execute(
+                "UPDATE items SET status = 'done', lease_expires = NULL, error = NULL"
+                " WHERE id = ? AND owner = ? AND status = 'leased'",
+                (item_id, owner),
+            )
+
+    def fail(self, owner, item_id, error):
+        """Release an item for another attempt, or mark it failed once MAX_ATTEMPTS is reached."""
+        with self.connect() as db:
+            db.execute(
+                "UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                " lease_expires = NULL, error = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+                (MAX_ATTEMPTS, str(error), item_id, owner),
+            )
+
+    def urls(self):
+        """Return the set of URLs published so far, whatever their state."""
+        with self.connect() as db:
+            return {row[0] for row in db.execute("SELECT url FROM items")}
+
+    def merge_done(self, merge):
+        """Call `merge(items)` with the item dicts of every item acked as done, holding the queue's write lock.
+
+        Lets workers (and the coordinator) add their results to files they
+        share, such as the progress file, without two processes rewriting
+        them at once.
+        """
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            items = [json.loads(row[0]) for row in db.execute("SELECT item FROM items WHERE status = 'done'")]
+            merge(items)
+            db.execute("COMMIT")
+
+    def counts(self):
+        """Return {status: count}, counting expired leases as pending (or failed if out of attempts)."""
+        with self.connect() as db:
+            rows = db.execute(
+                "SELECT CASE WHEN status = 'leased' AND lease_expires < ?"
+                " THEN CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END ELSE status END AS state,"
+                " COUNT(*) FROM items GROUP BY state",
+                (time.time(), MAX_ATTEMPTS),
+            ).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+class Connection:
+    """Close the SQLite connection on leaving the block (sqlite3's own context manager only commits)."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.db.in_transaction:
+            self.db.execute("ROLLBACK")
+        self.db.close()
+        return False
+
+def run_worker(queue, download, threads, owner=None):
+    """Claim, download and ack items until nothing is pending or leased.
+
+    `download(item, file_name)` returns True on success (after verifying the
+    file). A background heartbeat keeps this worker's leases alive; if the
+    process dies, the leases expire and other workers pick the items up.
+    """
+    owner = owner or worker_id()
+    stop = threading.Event()
+    interval = min(HEARTBEAT_INTERVAL, queue.lease_timeout / 3)
+    poll = min(POLL_INTERVAL, queue.lease_timeout / 4)
+
+    def heartbeat():
+        while not stop.wait(interval):
+            queue.heartbeat(owner)
+
+    def work():
+        done = 0
+        while True:
+            claimed = queue.claim(owner)
+            if not claimed:
+                counts = queue.counts()
+                if not counts.get('pending') and not counts.get('leased'):
+                    return done
+                time.sleep(poll)  # Others hold leases that may still expire back to us
+                continue
+            item_id, item, file_name = claimed[0]
+            try:
+                success = download(item, file_name)
+            except Exception as e:
+                queue.fail(owner, item_id, e)
+                continue
+            if success:
+                queue.ack(owner, item_id)
+                done += 1
+            else:
+                queue.fail(owner, item_id, "download failed")
+
+    beat = threading.Thread(target=heartbeat, daemon=True)
+    beat.start()
+    results = []
+    workers = [threading.Thread(target=lambda: results.append(work())) for _ in range(threads)]
+    try:
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    finally:
+        stop.set()
+    print(f"Worker {owner} finished {sum(results)} items; queue: {queue.counts()}")
+    return sum(results)